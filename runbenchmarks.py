@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+"""
+Rough timings for stardate's hot paths.
+
+Usage:
+    python runbenchmarks.py
+"""
+import os
+import sys
+import time
+
+import django
+
+COUNT = 10000
+
+
+def timed(label, func, count=COUNT):
+    start = time.time()
+    func()
+    elapsed = time.time() - start
+    sys.stdout.write('{0:<40} {1:>8.3f}s {2:>12.0f}/s\n'.format(
+        label, elapsed, count / elapsed))
+
+
+def bench_post_init():
+    from django.contrib.auth.models import User
+    from stardate.models import Blog
+    from stardate.utils import get_post_model
+
+    Post = get_post_model()
+
+    user = User.objects.create(username='benchmark')
+    blog = Blog.objects.create(
+        name='Benchmark',
+        backend_class='stardate.backends.local_file.LocalFileBackend',
+        backend_file='/dev/null',
+        user=user,
+    )
+    Post.objects.bulk_create([
+        Post(blog=blog, title='Post {0}'.format(i), slug='post-{0}'.format(i),
+             stardate=str(i), body='Body {0}.'.format(i))
+        for i in range(COUNT)
+    ])
+
+    timed('Post() x {0}'.format(COUNT), lambda: [
+        Post(blog_id=blog.pk, title='Post {0}'.format(i)) for i in range(COUNT)])
+    timed('list(Post.objects.all()) x {0}'.format(COUNT),
+          lambda: list(Post.objects.all()))
+
+
+def bench_front_matter():
+    import yaml
+    from stardate.parsers import load_front_matter
+
+    blocks = [
+        'publish: 2012-01-02 09:00 AM -0500\n'
+        'stardate: 1d7e8c2a-a6a4-11e5-9c4b-7831c1d1a7b8\n'
+        'timezone: US/Eastern\n'
+        'title: Post number {0}'.format(i)
+        for i in range(COUNT)
+    ]
+
+    timed('front matter, fast path', lambda: [
+        load_front_matter(block) for block in blocks])
+
+    if hasattr(yaml, 'CFullLoader'):
+        timed('front matter, libyaml', lambda: [
+            yaml.load(block, Loader=yaml.CFullLoader) for block in blocks])
+
+    loader = getattr(yaml, 'FullLoader', yaml.Loader)
+    timed('front matter, pure-Python yaml', lambda: [
+        yaml.load(block, Loader=loader) for block in blocks])
+
+
+def bench_parse_publish():
+    from dateutil.parser import parse
+    from stardate.parsers import FileParser, parse_datetime
+
+    parser = FileParser()
+    dates = ['2012-01-{0:02d} 09:00 AM -0500'.format(i % 28 + 1) for i in range(COUNT)]
+
+    timed('publish dates, fast path', lambda: [
+        parse_datetime(date) for date in dates])
+    timed('publish dates, dateutil', lambda: [
+        parse(date) for date in dates])
+    timed('parse_publish with timezone', lambda: [
+        parser.parse_publish(date, 'US/Eastern') for date in dates])
+
+
+def bench_unpack():
+    from stardate.parsers import FileParser, ParseCache
+
+    # The default cache size, which may be smaller than the file
+    parser = FileParser(cache=ParseCache())
+    content = parser.delimiter.join(
+        'publish: 2012-01-02 09:00 AM -0500\n'
+        'title: Post number {0}\n\n\nBody of post {0}.'.format(i)
+        for i in range(COUNT))
+
+    timed('unpack, cold parse cache', lambda: parser.unpack(content))
+    timed('unpack, warm parse cache', lambda: parser.unpack(content))
+
+
+def bench_push_blog_file():
+    import tempfile
+    from django.contrib.auth.models import User
+    from stardate.models import Blog
+    from stardate.parsers import FileParser
+    from stardate.utils import get_post_model
+
+    Post = get_post_model()
+    parser = FileParser()
+
+    fd, path = tempfile.mkstemp(suffix='.txt')
+    with os.fdopen(fd, 'w') as f:
+        f.write(parser.delimiter.join(
+            'publish: 2012-01-02 09:00 AM -0500\n'
+            'stardate: 1d7e8c2a-a6a4-11e5-9c4b-{0:012d}\n'
+            'title: Post number {0}\n\n\n{1}'.format(i, 'Body of post. ' * 50)
+            for i in range(COUNT)))
+
+    user = User.objects.create(username='pusher')
+    blog = Blog.objects.create(
+        name='Push benchmark',
+        backend_class='stardate.backends.local_file.LocalFileBackend',
+        backend_file=path,
+        user=user,
+    )
+    post = Post(blog=blog, title='Post number 5000',
+                stardate='1d7e8c2a-a6a4-11e5-9c4b-{0:012d}'.format(5000),
+                body='A changed body.')
+    post.clean()
+
+    try:
+        timed('push one post into {0}'.format(COUNT),
+              lambda: blog.backend.push([post]), count=1)
+    finally:
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    os.environ['DJANGO_SETTINGS_MODULE'] = 'tests.test_settings'
+    django.setup()
+
+    from django.db import connection
+    from django.test.utils import setup_test_environment
+
+    setup_test_environment()
+    db_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        bench_post_init()
+        bench_front_matter()
+        bench_parse_publish()
+        bench_unpack()
+        bench_push_blog_file()
+    finally:
+        connection.creation.destroy_test_db(db_name, verbosity=0)
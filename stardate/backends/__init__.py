@@ -1,7 +1,14 @@
 import os
+import hashlib
 import logging
+import tempfile
+import threading
 
+from bisect import insort
 from datetime import datetime
+from itertools import islice
+from multiprocessing import Pool, TimeoutError
+from multiprocessing.pool import ThreadPool
 
 from django.conf import settings
 from django.core.exceptions import ValidationError
@@ -13,12 +20,24 @@ try:
 except ImportError:
     from django.db.transaction import commit_on_success as atomic
 
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
 try:
     from importlib import import_module
 except ImportError:
     from django.utils.importlib import import_module
 
-from stardate.utils import get_post_model
+try:
+    from multiprocessing import get_context
+except ImportError:
+    # Python<3.4
+    get_context = None
+
+from stardate.caching import bump_blog_version
+from stardate.utils import get_post_model, setup_worker
 
 
 Post = get_post_model()
@@ -38,6 +57,40 @@ DEFAULT_BACKENDS = {
 
 STARDATE_BACKENDS = getattr(settings, 'STARDATE_BACKENDS', DEFAULT_BACKENDS)
 
+# Number of posts written per query when syncing
+BATCH_SIZE = getattr(settings, 'STARDATE_BATCH_SIZE', 500)
+
+# Number of threads used to read and write post files concurrently
+WORKERS = getattr(settings, 'STARDATE_WORKERS', 8)
+
+# Keys used to match local posts to remote posts, in order of preference
+MATCH_KEYS = ('stardate', 'title')
+
+# Processes directory blog files are parsed on, None parses them in-process.
+# Workers are spawned and set up Django from DJANGO_SETTINGS_MODULE.
+PARSE_PROCESSES = getattr(settings, 'STARDATE_PARSE_PROCESSES', None)
+
+# Fewest files in a directory blog worth starting the parse processes for
+PARSE_PROCESS_THRESHOLD = getattr(settings, 'STARDATE_PARSE_PROCESS_THRESHOLD', 200)
+
+# Seconds to wait on the parse processes before parsing in-process instead
+PARSE_TIMEOUT = getattr(settings, 'STARDATE_PARSE_TIMEOUT', 10 * 60)
+
+# Directory parsed blog files are snapshotted to, None disables snapshots
+SNAPSHOT_DIR = getattr(settings, 'STARDATE_SNAPSHOT_DIR', None)
+
+
+class PushError(Exception):
+    """
+    Raised when some post files could not be written. ``errors`` holds the
+    path and exception of each, ``responses`` a response per post.
+    """
+    def __init__(self, errors, responses):
+        super(PushError, self).__init__(u'Could not push {0}'.format(
+            u', '.join(path for path, err in errors)))
+        self.errors = errors
+        self.responses = responses
+
 
 def get_backend(backend=None, blog=None):
     i = backend.rfind('.')
@@ -59,6 +112,8 @@ class StardateBackend(object):
         self.name = kwargs.get('name', None)
         self.parser = kwargs.get('parser', None)
         self.social_auth = kwargs.get('social_auth', None)
+        # The stardate read from each file of a directory blog by iter_posts
+        self.parsed_stardates = {}
 
     def get_name(self):
         return self.name
@@ -74,126 +129,335 @@ class StardateBackend(object):
 
     def _update_from_dict(self, blog, post_dict, post=None):
         """
-        Create or update a Post from a dictionary
+        Create or update an unsaved Post from a dictionary
+
+        Returns a tuple of the post and whether it differs from the version
+        stored locally. New posts that fail validation are returned as None.
         """
-        created = False
-        save = True
+        if post is None:
+            post = Post(blog=blog, **post_dict)
 
-        # If a post is not provided, try and fetch it
-        if not post:
-            if 'stardate' in post_dict:
-                try:
-                    post = Post.objects.get(
-                        blog=blog,
-                        stardate=post_dict['stardate']
-                    )
-                except Exception as e:
-                    logger.exception('something went boom')
-                    logger.debug(post_dict)
-            if not post:
-                post_dict['blog'] = blog
-
-                post = Post(**post_dict)
+            try:
+                post.clean()
+                post.full_clean(exclude=['blog'], validate_unique=False)
+            except ValidationError as e:
+                # invalid posts should not be returned in this list
+                logger.exception('Caught an exception processing {}'.format(post))
+                return None, False
+            return post, True
 
-                try:
-                    post.clean()
-                    post.full_clean()
-                except ValidationError as e:
-                    # invalid posts should not be returned in this list
-                    logger.exception('Caught an exception processing {}'.format(post))
-                    save = False
-                    return
+        before = self._field_values(post, post_dict)
 
-        push = False
+        # Update from dict values
+        for att, value in post_dict.items():
+            setattr(post, att, value)
+        post.clean()
+
+        return post, before != self._field_values(post, post_dict)
 
-        for key, value in post_dict.items():
+    def _field_values(self, post, post_dict):
+        values = {}
+        for key in post_dict:
             if key == 'body':
-                post_value = getattr(post, key).raw
+                values[key] = getattr(post, key).raw
             else:
-                post_value = getattr(post, key)
+                values[key] = getattr(post, key)
+        return values
 
-            if value != post_value:
-                push = True
+    def _is_stale(self, post, remote_post):
+        """
+        Whether the remote copy of a post differs from the local one once
+        both are rendered
+        """
+        local_post = post.serialized()
+        remote_post = dict((key, remote_post.get(key)) for key in local_post)
+        return self.parser.render(remote_post) != self.parser.render(local_post)
 
-        # Update from dict values
-        if not created:
-            for att, value in post_dict.items():
-                setattr(post, att, value)
-            logger.debug('push is {}'.format(push))
+    def _upsert_posts(self, remote_posts):
+        """
+        Write remote post dictionaries to the database in bulk
+
+        Remote posts are read in chunks of ``BATCH_SIZE``. The existing posts
+        for a chunk are loaded in a single query keyed by stardate, and its
+        inserts and updates are written before the next chunk is read, so
+        memory stays bounded however many posts there are.
+        """
+        blog = self.blog
+        slugs = set(blog.posts.values_list('slug', flat=True))
 
-            if save:
-                post.save(push=push)
-        logger.info('Blog: %s, Post: %s, created=%s', post.blog, post, created)
-        return post
+        result = SyncResult(blog=blog)
+        written = set()
+        # stardates of posts whose remote copy needs to be written back
+        stale = []
+        flagged = set()
 
-    def get_posts(self):
+        for chunk in ichunked(remote_posts, BATCH_SIZE):
+            stardates = [post['stardate'] for post in chunk if post.get('stardate')]
+            existing = {}
+            if stardates:
+                existing = dict((post.stardate, post)
+                                for post in blog.posts.filter(stardate__in=stardates))
+
+            created = []
+            updated = []
+            updated_ids = set()
+
+            for remote_post in chunk:
+                post = existing.get(remote_post.get('stardate'))
+                is_new = post is None
+
+                post, changed = self._update_from_dict(blog, remote_post, post)
+
+                if post is None:
+                    continue
+
+                if is_new:
+                    if post.slug in slugs:
+                        logger.warning(u'Skipping {}, slug "{}" is already in use'.format(post, post.slug))
+                        continue
+                    slugs.add(post.slug)
+                    existing[post.stardate] = post
+                    created.append(post)
+                elif not changed:
+                    result.unchanged += 1
+                elif post.pk and post.pk not in updated_ids:
+                    updated_ids.add(post.pk)
+                    updated.append(post)
+
+                if (is_new or changed) and post.stardate not in written:
+                    written.add(post.stardate)
+                    result.append(post.stardate)
+
+                if post.stardate not in flagged and self._is_stale(post, remote_post):
+                    flagged.add(post.stardate)
+                    stale.append(post.stardate)
+
+            batch_save(created, updated)
+            result.created += len(created)
+            result.updated += len(updated)
+
+        if result.created or result.updated:
+            Post.objects.link_neighbours(blog=blog)
+
+        result.stale = stale
+
+        logger.info(u'Blog: {}, created={}, updated={}, unchanged={}'.format(
+            blog, result.created, result.updated, result.unchanged))
+        return result
+
+    def get_posts(self, paths=None):
         """
         Fetch post dictionaries from single file or directory by reading and
-        parsing file content into post dictionaries.
+        parsing file content into post dictionaries. Files in a directory are
+        fetched concurrently on up to ``WORKERS`` threads, ``paths`` limits
+        them to the given files.
 
         Returns an array of Post dictionairies.
         """
+        return list(self.iter_posts(paths))
+
+    def iter_posts(self, paths=None):
+        """
+        Yield the post dictionaries ``get_posts`` returns as they are parsed.
+        A single blog file is streamed rather than read into memory at once.
+        """
         path = self.blog.backend_file
-        ext = get_extension(path)
-        posts = []
 
-        if ext:
-            content = self.get_file(path)
-            if content:
-                posts = self.parser.unpack(content)
+        if get_extension(path):
+            fingerprint = self.get_fingerprint(path) if SNAPSHOT_DIR else None
+            snapshot = self._snapshot_path(path)
+
+            posts = None
+            if fingerprint is not None:
+                posts = load_snapshot(snapshot, self._snapshot_key(fingerprint))
+
+            if posts is None:
+                posts = self.parser.iter_unpack(self.iter_file(path))
+                if fingerprint is not None:
+                    posts = save_snapshot(snapshot, self._snapshot_key(fingerprint), posts)
+
+            for post in posts:
+                yield post
         else:
-            for file_name in self._list_path(path):
-                content = self.get_file(file_name)
+            if paths is None:
+                paths = self._list_path(path)
 
-                try:
-                    post = self.parser.parse(content)
-                    posts.append(post)
-                except:
-                    continue
-        return posts
+            if PARSE_PROCESSES and len(paths) >= PARSE_PROCESS_THRESHOLD:
+                posts = self._parse_in_processes(paths, PARSE_PROCESSES)
+            else:
+                posts = map_concurrent(self._fetch_post, paths)
+
+            self.parsed_stardates = {}
+            for path, post in zip(paths, posts):
+                if post:
+                    self.parsed_stardates[path] = post.get('stardate')
+                    yield post
+
+    def get_fingerprint(self, path):
+        """
+        Return a value that changes whenever the file at ``path`` does, such
+        as its size and modified time, or None if there isn't one
+        """
+        return None
+
+    def _snapshot_path(self, path):
+        name = u'{0}:{1}:{2}'.format(self.name, self.blog.pk, path)
+        name = hashlib.sha1(name.encode('utf-8')).hexdigest()
+        return os.path.join(SNAPSHOT_DIR or '', '{0}.pickle'.format(name))
+
+    def _snapshot_key(self, fingerprint):
+        # A new parser version makes every snapshot out of date
+        parser = self.parser.__class__
+        return (parser.__module__, parser.__name__,
+                getattr(parser, 'version', None), fingerprint)
+
+    def iter_file(self, path):
+        """
+        Iterate over the content of a file in chunks. Backends that can
+        stream a download should override this.
+        """
+        content = self.get_file(path)
+        if content:
+            yield content
+
+    def _fetch_post(self, path):
+        """
+        Download and parse a single post file. Errors are logged and return
+        None so that one bad file doesn't stop the others.
+        """
+        try:
+            return self.parser.parse(self.get_file(path))
+        except Exception:
+            logger.exception(u'Could not fetch {}'.format(path))
+            return None
+
+    def _fetch_file(self, path):
+        """
+        Download a single post file, returning None on errors
+        """
+        try:
+            return self.get_file(path)
+        except Exception:
+            logger.exception(u'Could not fetch {}'.format(path))
+            return None
+
+    def _parse_in_processes(self, paths, processes):
+        """
+        Download files on threads and parse them on a pool of processes,
+        which get around the GIL for the CPU bound parsing
+        """
+        contents = map_concurrent(self._fetch_file, paths)
+        parser_class = self.parser.__class__
+        args = [(parser_class, path, content) for path, content in zip(paths, contents)]
+
+        pool = get_parse_pool(processes)
+        if pool is not None:
+            result = pool.map_async(parse_content, args,
+                                    chunksize=max(len(paths) // (processes * 4), 1))
+            try:
+                return result.get(PARSE_TIMEOUT)
+            except TimeoutError:
+                # Workers that can't set up Django are respawned forever
+                logger.error(u'Parse processes timed out, parsing in-process')
+                close_parse_pool(processes)
+        return [parse_content(arg) for arg in args]
+
+    def get_changed_paths(self, path, full=False):
+        """
+        Return the files in a directory blog that changed since the last
+        pull, along with state to hand to ``save_sync_state`` once they have
+        been saved. Backends that can't tell return every file.
+        """
+        return self._list_path(path), None
+
+    def save_sync_state(self, path, state):
+        pass
+
+    def get_pushed_sync(self, responses, last_sync=None):
+        """
+        Return the remote modified time after a push, given the responses
+        from ``write_file`` and the ``last_sync`` read at the start of the
+        pull
+        """
+        return self.last_sync
 
     def push_blog_file(self, posts):
         """
         Update posts in a single blog file
+
+        Only the segments of the file that hold a changed post are rendered
+        and spliced in, new posts are appended to the end. Every other post
+        is copied as is.
         """
-        remote_posts = self.get_posts()
+        path = self.blog.backend_file
+        content = self.get_file(path) or ''
+        if isinstance(content, bytes) and not isinstance(content, str):
+            content = content.decode('utf-8')
+
+        # The offsets and post of every segment of the file, in order
+        segments = list(self.parser.iter_spans(content))
+        remote_posts = [post or {} for start, end, post in segments]
 
         # Use serialized version of posts to find
         # and update
         local_posts = [post.serialized() for post in posts]
 
-        # Update remote_posts with local versions
-        ## FIXME: n^2 crawl, use stardate as keys
-        ## in dicts instead of lists?
+        # Update remote_posts with local versions. Remote posts are indexed
+        # by stardate and title so each local post is matched in constant
+        # time, first by stardate and then by title for posts that were
+        # created remotely and have only just been given a stardate.
+        indexes = dict(
+            (key, index_posts(remote_posts, key)) for key in MATCH_KEYS)
+        # Remote posts as they were before the update, by position
+        originals = {}
+
         for local_post in local_posts:
-            exists = False
-            # First we try to see if match by stardate exists
-            for remote_post in remote_posts:
-                if 'stardate' in remote_post:
-                    if local_post['stardate'] == remote_post['stardate']:
-                        exists = True
-                        remote_post.update(local_post)
-                        break
-
-            # If post was created remotely and was pulled in
-            # then it has a stardate, but remote post does not.
-            # Try to match up using title
-            if not exists:
-                for remote_post in remote_posts:
-                    if 'title' in remote_post:
-                        if local_post['title'] == remote_post['title']:
-                            exists = True
-                            remote_post.update(local_post)
-                            break
-
-            # Add new remote post if it does not exist yet
-            if not exists:
+            position = None
+
+            for key in MATCH_KEYS:
+                position = find_post(remote_posts, indexes[key], key, local_post[key])
+                if position is not None:
+                    break
+
+            if position is None:
+                # Add new remote post if it does not exist yet
                 remote_posts.append(local_post)
+                position = len(remote_posts) - 1
+            else:
+                if position < len(segments):
+                    originals.setdefault(position, dict(remote_posts[position]))
+                remote_posts[position].update(local_post)
+
+            # Keep the indexes in step with the updated post
+            for key in MATCH_KEYS:
+                if key in remote_posts[position]:
+                    positions = indexes[key].setdefault(remote_posts[position][key], [])
+                    if position not in positions:
+                        insort(positions, position)
+
+        delimiter = self.parser.delimiter
+        replacements = []
+
+        for position in sorted(originals):
+            rendered = self.parser.render(remote_posts[position])
+            if rendered != self.parser.render(originals[position]):
+                start, end, post = segments[position]
+                replacements.append((start, end, rendered))
+
+        added = [self.parser.render(post) for post in remote_posts[len(segments):]]
+        if added:
+            start, end, post = segments[-1]
+            if start == end:
+                # Fill an empty last segment, such as an empty file
+                replacements.append((start, end, delimiter.join(added)))
+            else:
+                replacements.append((end, end, delimiter + delimiter.join(added)))
 
-        # Turn post list back into string
-        content = self.parser.pack(remote_posts)
+        if not replacements:
+            return None
 
-        return self.write_file(self.blog.backend_file, content)
+        content = splice(content, replacements)
+        return self.write_file(path, content)
 
     def write_file(self, path, content):
         raise NotImplementedError
@@ -201,22 +465,41 @@ class StardateBackend(object):
     def push_post_files(self, folder, posts):
         """
         Update posts in multiple files
+
+        Files are read, merged, rendered and written on up to ``WORKERS``
+        threads. Returns a response per post in the order of ``posts``. If
+        any post could not be written, PushError is raised once the others
+        have been, with the exception in that post's response.
         """
         local_posts = [post.serialized() for post in posts]
 
-        for local_post in local_posts:
-            # Generate the post file path dynamically
-            post_path = self._get_post_path(folder, local_post)
+        responses = map_concurrent(
+            lambda local_post: self._push_post_file(folder, local_post),
+            local_posts
+        )
+
+        errors = [(self._get_post_path(folder, local_post), response)
+                  for local_post, response in zip(local_posts, responses)
+                  if isinstance(response, Exception)]
+        if errors:
+            raise PushError(errors, responses)
+        return responses
 
+    def _push_post_file(self, folder, local_post):
+        # Generate the post file path dynamically
+        post_path = self._get_post_path(folder, local_post)
+
+        try:
             # Get the existing remote post as a post dict
-            remote_post = self.get_post(post_path)
+            remote_post = self.get_post(post_path) or {}
 
             # Update the contents of the remote post
             remote_post.update(local_post)
             content = self.parser.render(remote_post)
-            self.write_file(post_path, content)
-        return
-
+            return self.write_file(post_path, content)
+        except Exception as err:
+            logger.exception(u'Could not push {}'.format(post_path))
+            return err
 
     def push(self, posts):
         """
@@ -244,14 +527,18 @@ class StardateBackend(object):
 
         return responses
 
-    def pull(self, force=False):
+    def pull(self, force=False, write_back=True):
         """
         Update local posts from remote source
 
-        blog: Blog instance
+        Posts whose remote copy is missing local changes, such as a generated
+        stardate, are written back at the end of the run, a chunk of
+        ``BATCH_SIZE`` per push.
+        Pass ``write_back=False`` to never write to the remote source.
         """
         blog = self.blog
-        last_sync = blog.backend.last_sync
+        # Remote metadata is read once and carried through the run
+        last_sync = self.last_sync
         updated_list = []
 
         if not blog.sync:
@@ -264,19 +551,37 @@ class StardateBackend(object):
         else:
             logger.info(u'Forced sync using --force')
 
-        remote_posts = self.get_posts()
+        sync_state = None
 
-        for remote_post in remote_posts:
-            updated = self._update_from_dict(blog, remote_post)
+        if get_extension(blog.backend_file):
+            remote_posts = self.iter_posts()
+        else:
+            # Only fetch the files of a directory blog that changed
+            paths, sync_state = self.get_changed_paths(blog.backend_file, full=force)
+            remote_posts = self.iter_posts(paths)
 
-            if updated:
-                updated_list.append(updated)
+        updated_list = self._upsert_posts(remote_posts)
 
-        batch_save(updated_list)
+        if sync_state is not None:
+            self.save_sync_state(blog.backend_file, sync_state)
+
+        if write_back and updated_list.stale:
+            logger.info(u'Writing back {} posts for {}'.format(len(updated_list.stale), blog))
+            # A chunk at a time, so only one chunk of posts is in memory
+            for chunk in chunked(updated_list.stale, BATCH_SIZE):
+                responses = self.push(list(load_posts(blog, chunk)))
+            last_sync = self.get_pushed_sync(responses, last_sync)
         logger.info(u'Updated {} posts for {}'.format(len(updated_list), blog))
 
-        blog.last_sync = blog.backend.last_sync
-        blog.save()
+        if updated_list.created or updated_list.updated:
+            # Bulk writes skip the post signals that clear cached pages
+            bump_blog_version(blog.pk)
+
+        # An update rather than a save, whose signal would clear the blog's
+        # cached pages when nothing changed
+        blog.last_sync = last_sync
+        type(blog).objects.filter(pk=blog.pk).update(
+            last_sync=last_sync, sync_state=blog.sync_state)
         logger.info('last_sync updated: {}'.format(last_sync))
 
         return updated_list
@@ -293,15 +598,297 @@ def get_extension(path):
     return os.path.splitext(path)[-1].lower()
 
 
-@atomic
-def batch_save(queryset):
-    for obj in queryset:
-        push = False
+def index_posts(posts, key):
+    """
+    Map each value of ``key`` to the positions of the posts that have it,
+    in order.
+    """
+    index = {}
+    for position, post in enumerate(posts):
+        if key in post:
+            index.setdefault(post[key], []).append(position)
+    return index
+
+
+def find_post(posts, index, key, value):
+    """
+    Return the position of the first post whose ``key`` is ``value``.
+    Positions of posts that have since changed are skipped.
+    """
+    for position in index.get(value, ()):
+        if posts[position].get(key) == value:
+            return position
+    return None
+
+
+def splice(content, replacements):
+    """
+    Replace spans of ``content`` with new text. ``replacements`` are
+    ``(start, end, text)`` tuples in order that don't overlap.
+    """
+    pieces = []
+    last = 0
+    for start, end, text in replacements:
+        pieces.append(content[last:start])
+        pieces.append(text)
+        last = end
+    pieces.append(content[last:])
+    return ''.join(pieces)
+
+
+def map_concurrent(func, items, workers=None):
+    """
+    Like ``map``, but calls ``func`` from a pool of up to ``workers``
+    threads. Results are returned in the order of ``items``.
+    """
+    items = list(items)
+    workers = min(workers or WORKERS, len(items))
+
+    if workers <= 1:
+        return [func(item) for item in items]
+
+    pool = ThreadPool(workers)
+    try:
+        return pool.map(func, items)
+    finally:
+        pool.close()
+        pool.join()
+
+
+parse_pools = {}
+parse_pools_lock = threading.Lock()
+
+
+def get_parse_pool(processes):
+    """
+    Return the pool of ``processes`` workers files are parsed on, started
+    once per process. Workers are spawned rather than forked, since pulls run
+    on webhook threads and a fork copies locks other threads hold. Without
+    spawn, on Python<3.4, the pool is only used from the main thread and
+    None is returned elsewhere.
+    """
+    if get_context is None:
+        if threading.current_thread().name != 'MainThread':
+            logger.warning(u'Parsing in-process, off the main thread')
+            return None
+        context = None
+    else:
+        context = get_context('spawn')
+
+    with parse_pools_lock:
+        pool = parse_pools.get(processes)
+        if pool is None:
+            if context is None:
+                pool = Pool(processes)
+            else:
+                # Workers set up Django before they import the backends to
+                # unpickle their tasks
+                pool = context.Pool(processes, initializer=setup_worker)
+            parse_pools[processes] = pool
+    return pool
+
+
+def close_parse_pool(processes):
+    """
+    Stop the pool of ``processes`` workers, a later pull starts a new one
+    """
+    with parse_pools_lock:
+        pool = parse_pools.pop(processes, None)
+    if pool is not None:
+        pool.terminate()
+        pool.join()
+
+
+def parse_content(args):
+    """
+    Parse the content of a post file in a worker process
+    """
+    parser_class, path, content = args
+    if content is None:
+        return None
+    try:
+        return parser_class().parse(content)
+    except Exception:
+        logger.exception(u'Could not parse {}'.format(path))
+        return None
+
+
+def load_snapshot(path, key):
+    """
+    Return an iterator over the posts snapshotted to ``path`` if it was
+    saved under ``key``, reading them a chunk at a time
+    """
+    try:
+        f = open(path, 'rb')
+    except (IOError, OSError):
+        return None
+
+    try:
+        snapshot_key = pickle.load(f)
+    except (EOFError, ValueError, pickle.UnpicklingError):
+        snapshot_key = None
+    except Exception:
+        logger.exception(u'Could not load snapshot {}'.format(path))
+        snapshot_key = None
+
+    if snapshot_key != key:
+        f.close()
+        return None
+    return iter_snapshot(f)
+
+
+def iter_snapshot(f):
+    """
+    Yield the posts in the chunks pickled to ``f`` after its key
+    """
+    with f:
+        while True:
+            try:
+                chunk = pickle.load(f)
+            except EOFError:
+                return
+            for post in chunk:
+                yield post
+
+
+def save_snapshot(path, key, posts):
+    """
+    Yield ``posts`` while writing them to a snapshot at ``path``, one pickle
+    per chunk. The file is only put in place once every post has been
+    written, so a reader never sees half a snapshot.
+    """
+    directory = os.path.dirname(path)
+    try:
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        f = os.fdopen(fd, 'wb')
+        pickle.dump(key, f, pickle.HIGHEST_PROTOCOL)
+    except (IOError, OSError):
+        logger.exception(u'Could not save snapshot {}'.format(path))
+        f = None
+
+    try:
+        for chunk in ichunked(posts, BATCH_SIZE):
+            if f is not None:
+                try:
+                    # Pickled before callers get to change the posts
+                    pickle.dump(chunk, f, pickle.HIGHEST_PROTOCOL)
+                except (IOError, OSError):
+                    logger.exception(u'Could not save snapshot {}'.format(path))
+                    f = discard_snapshot(f, tmp_path)
+            for post in chunk:
+                yield post
+
+        if f is not None:
+            try:
+                f.close()
+                os.rename(tmp_path, path)
+            except (IOError, OSError):
+                logger.exception(u'Could not save snapshot {}'.format(path))
+                f = discard_snapshot(f, tmp_path)
+            f = None
+    finally:
+        # Posts that weren't all read leave no snapshot
+        if f is not None:
+            discard_snapshot(f, tmp_path)
+
+
+def discard_snapshot(f, tmp_path):
+    f.close()
+    try:
+        os.remove(tmp_path)
+    except OSError:
+        pass
+    return None
+
 
-        if obj.stardate:
-            push = True
+def chunked(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
 
-        obj.save(push=push)
+
+def ichunked(items, size):
+    """
+    Like ``chunked`` for any iterable, only reading a chunk at a time
+    """
+    items = iter(items)
+    chunk = list(islice(items, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(items, size))
+
+
+@atomic
+def batch_save(created, updated, batch_size=None):
+    """
+    Insert and update posts in chunks of ``batch_size``
+
+    Primary keys are set on created posts from a single query per chunk on
+    databases where ``bulk_create`` does not return them.
+    """
+    batch_size = batch_size or BATCH_SIZE
+
+    for chunk in chunked(created, batch_size):
+        Post.objects.bulk_create(chunk)
+        if not all(post.pk for post in chunk):
+            ids = dict(Post.objects.filter(
+                blog=chunk[0].blog_id,
+                stardate__in=[post.stardate for post in chunk]
+            ).values_list('stardate', 'pk'))
+
+            for post in chunk:
+                post.pk = ids[post.stardate]
+
+    # Relations are never changed by a pull
+    fields = [f for f in Post._meta.concrete_fields
+              if not f.primary_key and not f.is_relation]
+
+    for chunk in chunked(updated, batch_size):
+        for post in chunk:
+            # Bulk updates skip Field.pre_save, which renders markup
+            for field in fields:
+                setattr(post, field.attname, field.pre_save(post, False))
+
+        if hasattr(Post.objects, 'bulk_update'):
+            # Django>=2.2
+            Post.objects.bulk_update(chunk, [f.name for f in fields])
+        else:
+            for post in chunk:
+                Post.objects.filter(pk=post.pk).update(
+                    **dict((f.attname, getattr(post, f.attname)) for f in fields))
+
+
+def load_posts(blog, stardates):
+    """
+    Yield the posts of ``blog`` with ``stardates`` in that order, loading a
+    chunk of ``BATCH_SIZE`` at a time
+    """
+    for chunk in chunked(stardates, BATCH_SIZE):
+        posts = dict((post.stardate, post)
+                     for post in blog.posts.filter(stardate__in=chunk))
+        for stardate in chunk:
+            if stardate in posts:
+                yield posts[stardate]
+
+
+class SyncResult(list):
+    """
+    The stardates of the posts written by a pull in remote order, with
+    counts of created, updated and unchanged posts. ``posts()`` loads the
+    posts themselves a chunk at a time.
+    """
+    def __init__(self, *args, **kwargs):
+        self.blog = kwargs.pop('blog', None)
+        super(SyncResult, self).__init__(*args, **kwargs)
+        self.created = 0
+        self.updated = 0
+        self.unchanged = 0
+        # stardates of posts whose remote copy needs to be written back
+        self.stale = []
+
+    def posts(self):
+        return load_posts(self.blog, self)
 
 
 class BaseStardateParser(object):
@@ -310,3 +897,6 @@ class BaseStardateParser(object):
 
     def unpack(self):
         raise NotImplementedError
+
+    def iter_unpack(self, source):
+        raise NotImplementedError
@@ -1,23 +1,93 @@
 from __future__ import absolute_import
+import hashlib
 import json
 import logging
 import os
+import threading
+import time
 
 from django.conf import settings
 from django.core.cache import cache
 from django.core.exceptions import ImproperlyConfigured
+from django.utils import timezone
 from django.utils.timezone import make_aware, is_aware
 
-from dropbox import Dropbox
+from dropbox import Dropbox, create_session
 from dropbox.exceptions import ApiError
-from dropbox.files import WriteMode
+from dropbox.files import (
+    DeletedMetadata, FileMetadata, FolderMetadata, WriteMode
+)
 
-from stardate.backends import StardateBackend
-from stardate.parsers import FileParser
+from stardate.backends import StardateBackend, get_extension
+from stardate.parsers import CHUNK_SIZE, FileParser
 
 
 logger = logging.getLogger('stardate')
 
+# Seconds a cached folder listing is fresh for
+LISTING_TTL = getattr(settings, 'STARDATE_LISTING_TTL', 60 * 5)
+
+# Seconds a stale listing is still served while it is refreshed
+LISTING_STALE_TTL = getattr(settings, 'STARDATE_LISTING_STALE_TTL', 60 * 60)
+
+# Most bytes of paths kept in a cached listing, under memcached's 1MB limit
+LISTING_MAX_BYTES = getattr(settings, 'STARDATE_LISTING_MAX_BYTES', 512 * 1024)
+
+
+# Size of the HTTP connection pool shared by every Dropbox client
+MAX_CONNECTIONS = getattr(settings, 'STARDATE_DROPBOX_MAX_CONNECTIONS', 8)
+
+
+class ClientRegistry(object):
+    """
+    Process-wide Dropbox clients, one per account, that share a pooled HTTP
+    session. An account's client is replaced when its access token changes.
+    """
+    def __init__(self, max_connections=MAX_CONNECTIONS):
+        self.max_connections = max_connections
+        self.clients = {}
+        self.lock = threading.Lock()
+        self.session = None
+        self.stats = {
+            'hits': 0,
+            'misses': 0,
+            'created': 0,
+            'invalidations': 0,
+        }
+
+    def get(self, uid, token):
+        with self.lock:
+            if self.session is None:
+                self.session = create_session(max_connections=self.max_connections)
+
+            cached = self.clients.get(uid)
+            if cached and cached[0] == token:
+                self.stats['hits'] += 1
+                return cached[1]
+
+            if cached:
+                self.stats['invalidations'] += 1
+            self.stats['misses'] += 1
+
+            client = Dropbox(token, session=self.session)
+            self.stats['created'] += 1
+            self.clients[uid] = (token, client)
+            return client
+
+    def invalidate(self, uid=None):
+        """
+        Drop the client for an account, or every client
+        """
+        with self.lock:
+            if uid is None:
+                self.stats['invalidations'] += len(self.clients)
+                self.clients.clear()
+            elif self.clients.pop(uid, None) is not None:
+                self.stats['invalidations'] += 1
+
+
+clients = ClientRegistry()
+
 
 class DropboxBackend(StardateBackend):
     def __init__(self, *args, **kwargs):
@@ -25,17 +95,25 @@ class DropboxBackend(StardateBackend):
         self.client = self.get_dropbox_client()
         self.name = u'dropbox'
         self.parser = FileParser()
+        self.metadata = None
 
     def get_file(self, path):
         metadata, file = self.client.files_download(path)
 
         return file.content
 
+    def iter_file(self, path):
+        metadata, file = self.client.files_download(path)
+
+        return file.iter_content(CHUNK_SIZE)
+
     def write_file(self, file_path, content):
         return self.client.files_upload(content, file_path, mode=WriteMode('overwrite', None))
 
     def get_social_auth(self):
-        return self.blog.user.social_auth.get(provider='dropbox-oauth2')
+        if self.social_auth is None:
+            self.social_auth = self.blog.user.social_auth.get(provider='dropbox-oauth2')
+        return self.social_auth
 
     def get_post(self, path):
         try:
@@ -54,43 +132,129 @@ class DropboxBackend(StardateBackend):
             pass
         return extra_data.get('access_token')
 
-    def get_cursor(self):
+    def get_cursor(self, path=None):
+        """
+        Return the stored list-folder cursor, optionally for a given path
+        """
         extra_data = self.get_social_auth().extra_data
         try:
             if isinstance(extra_data, unicode):
                 extra_data = json.loads(extra_data)
         except NameError:
             pass
+        if path is not None:
+            return extra_data.get('cursors', {}).get(path)
         return extra_data.get('cursor')
 
     def get_dropbox_client(self):
         token = self.get_access_token()
-        return Dropbox(token)
+        return clients.get(self.get_social_auth().uid, token)
+
+    def _list_folder(self, path, cursor=None):
+        """
+        Page through a folder listing, or through the changes to it since
+        ``cursor``. Returns the entries and the latest cursor.
+        """
+        if cursor:
+            result = self.client.files_list_folder_continue(cursor)
+        else:
+            # The API lists the root folder as an empty path
+            result = self.client.files_list_folder('' if path == '/' else path)
+
+        entries = list(result.entries)
+        while result.has_more:
+            result = self.client.files_list_folder_continue(result.cursor)
+            entries.extend(result.entries)
+        return entries, result.cursor
+
+    def _list_path(self, path='/'):
+        """
+        List the contents of a path on the backend.
+        """
+        entries, cursor = self._list_folder(path)
 
-    def _list_path(self, path='/', hash=None):
+        return [entry.path_display for entry in entries
+                if not isinstance(entry, DeletedMetadata)]
+
+    def _cache_listing(self, path, paths):
+        """
+        Cache the listing of a path and return it as cached. Paths past
+        ``LISTING_MAX_BYTES`` are left out.
+        """
+        size = 0
+        for index, listed in enumerate(paths):
+            size += len(listed.encode('utf-8'))
+            if size > LISTING_MAX_BYTES:
+                logger.warning(u'Listing for {} cut off at {} of {} paths'.format(
+                    path, index, len(paths)))
+                paths = paths[:index]
+                break
+
+        cache.set(
+            self._listing_cache_key(path),
+            (paths, time.time() + LISTING_TTL),
+            LISTING_TTL + LISTING_STALE_TTL
+        )
+        return paths
+
+    def _listing_cache_key(self, path):
+        path_hash = hashlib.md5(path.encode('utf-8')).hexdigest()
+        return 'stardate:dropbox:paths:{0}:{1}'.format(
+            self.get_social_auth().uid, path_hash)
+
+    def get_cached_paths(self, path='/'):
         """
-        List the contents of a path on the backend. Each path can be passed
-        a `hash` argument that determines if anything new for the specified
-        path is returned.
+        List the contents of a path from the cache. A listing older than
+        ``LISTING_TTL`` is still returned while it is refreshed in the
+        background, for up to ``LISTING_STALE_TTL`` more seconds.
+        """
+        key = self._listing_cache_key(path)
+        cached = cache.get(key)
+
+        if cached is None:
+            return self._cache_listing(path, self._list_path(path))
+
+        paths, fresh_until = cached
+
+        # cache.add makes sure only one refresh runs at a time
+        if fresh_until < time.time() and cache.add(key + ':refresh', True, LISTING_TTL):
+            thread = threading.Thread(target=self._refresh_listing, args=(path, key))
+            thread.daemon = True
+            thread.start()
+        return paths
+
+    def _refresh_listing(self, path, key):
+        try:
+            self._cache_listing(path, self._list_path(path))
+        except Exception:
+            logger.exception(u'Could not refresh the listing for {}'.format(path))
+        finally:
+            cache.delete(key + ':refresh')
 
+    def get_changed_paths(self, path, full=False):
+        """
+        Return the files in ``path`` that changed since the stored cursor
+        for it, along with the new cursor. The first call lists every file.
         """
-        paths = cache.get('paths', [])
-        meta_hash = cache.get('hash', None)
+        cursor = None if full else self.get_cursor(path)
 
         try:
-            meta = self.client.files_get_metadata(path)
-            cache.delete('paths')
-            cache.set('hash', meta['hash'])
+            entries, cursor = self._list_folder(path, cursor)
         except ApiError as err:
-            raise err
+            if not cursor:
+                raise err
+            logger.info(u'Cursor for {} expired, listing every file'.format(path))
+            entries, cursor = self._list_folder(path)
 
-        for content in meta.get('contents', []):
-            paths.append(content['path'])
-        cache.set('paths', paths)
-        return paths
+        paths = [entry.path_display for entry in entries
+                 if isinstance(entry, FileMetadata)]
+        return paths, cursor
+
+    def save_sync_state(self, path, cursor):
+        self.save_cursor(cursor, path)
 
     def get_source_list(self):
-        paths = cache.get('paths') or self._list_path()
+        paths = self.get_cached_paths()
         source_list = ((0, u'---'),)
 
         #  Instead of using the index, could use slugify
@@ -101,7 +265,7 @@ class DropboxBackend(StardateBackend):
             pass
         return source_list
 
-    def save_cursor(self, cursor):
+    def save_cursor(self, cursor, path=None):
         social_auth = self.get_social_auth()
         extra_data = social_auth.extra_data
         try:
@@ -109,15 +273,52 @@ class DropboxBackend(StardateBackend):
                 extra_data = json.loads(extra_data)
         except NameError:
             pass
-        extra_data['cursor'] = cursor
+        if path is not None:
+            extra_data.setdefault('cursors', {})[path] = cursor
+        else:
+            extra_data['cursor'] = cursor
         social_auth.extra_data = extra_data
         social_auth.save()
 
     @property
     def last_sync(self):
-        modified = self.client.files_get_metadata(
-            self.blog.backend_file
-        ).server_modified
+        metadata = self.client.files_get_metadata(self.blog.backend_file)
+        # Kept for the fingerprint of the file pulled next
+        self.metadata = metadata
+
+        if isinstance(metadata, FolderMetadata):
+            # Folders have no modified time, their cursor tracks changes
+            return timezone.now()
+
+        return self._get_modified(metadata)
+
+    def get_fingerprint(self, path):
+        """
+        The file's revision, from the metadata ``last_sync`` just read if it
+        is for the same file
+        """
+        metadata, self.metadata = self.metadata, None
+        if metadata is None or metadata.path_lower != path.lower():
+            metadata = self.client.files_get_metadata(path)
+        return getattr(metadata, 'rev', None)
+
+    def get_pushed_sync(self, responses, last_sync=None):
+        """
+        Uploads return the file's new metadata, so a push to a single blog
+        file doesn't need another metadata call. A folder has no modified
+        time, so the one read at the start of the pull is kept.
+        """
+        if last_sync is not None and not get_extension(self.blog.backend_file):
+            return last_sync
+
+        for response in responses:
+            if isinstance(response, FileMetadata) and \
+                    response.path_lower == self.blog.backend_file.lower():
+                return self._get_modified(response)
+        return super(DropboxBackend, self).get_pushed_sync(responses)
+
+    def _get_modified(self, metadata):
+        modified = metadata.server_modified
 
         if not is_aware(modified):
             modified = make_aware(modified)
@@ -1,14 +1,16 @@
 from __future__ import absolute_import
 
+import datetime
+import json
 import os
-import time
+import stat
 
-from django.utils.timezone import make_aware, utc
+from django.utils import timezone
+from django.utils.timezone import utc
 
-from dateutil.parser import parse
-
-from stardate.backends import StardateBackend
-from stardate.parsers import FileParser
+from stardate.backends import BATCH_SIZE, Post, StardateBackend, chunked
+from stardate.caching import bump_blog_version
+from stardate.parsers import FileParser, iter_chunks
 
 
 class LocalFileBackend(StardateBackend):
@@ -29,6 +31,12 @@ class LocalFileBackend(StardateBackend):
             content = None
         return content
 
+    def iter_file(self, path):
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                for chunk in iter_chunks(f):
+                    yield chunk
+
     def get_post(self, path):
         if os.path.exists(path):
             content = self.get_file(path)
@@ -43,7 +51,106 @@ class LocalFileBackend(StardateBackend):
             paths.append(os.path.join(path, file))
         return paths
 
+    def get_fingerprint(self, path):
+        try:
+            return tuple(get_file_stat(os.stat(path)))
+        except OSError:
+            return None
+
+    def get_manifest(self):
+        """
+        Return the stat manifest stored by the last pull of a directory blog
+        """
+        try:
+            return json.loads(self.blog.sync_state or '{}')
+        except ValueError:
+            return {}
+
+    def get_changed_paths(self, path, full=False):
+        """
+        Return the files in ``path`` that are new or changed since the last
+        pull, going by their size, modification time and inode, along with
+        the new manifest and the stardates of the files deleted since.
+        """
+        previous = {} if full else self.get_manifest()
+        files = {}
+        changed = []
+
+        for file_path in self._list_path(path):
+            try:
+                file_stat = os.stat(file_path)
+            except OSError:
+                continue
+            if not stat.S_ISREG(file_stat.st_mode):
+                continue
+
+            entry = get_file_stat(file_stat)
+            known = previous.get(file_path)
+            if known and known[:3] == entry:
+                # Unchanged files keep the stardate read from them before
+                files[file_path] = entry + known[3:4]
+            else:
+                files[file_path] = entry
+                changed.append(file_path)
+
+        # Manifests saved before stardates were stored can't say which
+        # post a deleted file held
+        deleted = [entry[3] for file_path, entry in previous.items()
+                   if file_path not in files and len(entry) > 3]
+        return changed, {'files': files, 'changed': changed, 'deleted': deleted}
+
+    def save_sync_state(self, path, state):
+        """
+        Store the stardate read from each changed file in the manifest, mark
+        the posts of deleted files as deleted and keep the manifest on the
+        blog, which the pull saves
+        """
+        files = state['files']
+        seen = set()
+        for file_path in state['changed']:
+            stardate = self.parsed_stardates.get(file_path)
+            if stardate:
+                files[file_path] = files[file_path][:3] + [stardate]
+                seen.add(stardate)
+
+        # A post read from another file in this pull was moved, not deleted
+        deleted = set(state['deleted']) - seen
+        if deleted:
+            self.delete_posts(deleted)
+        self.blog.sync_state = json.dumps(files)
+
+    def delete_posts(self, stardates):
+        """
+        Mark the posts with ``stardates`` as deleted
+        """
+        count = 0
+        for chunk in chunked(sorted(stardates), BATCH_SIZE):
+            count += self.blog.posts.filter(deleted=False, stardate__in=chunk).update(
+                deleted=True, modified=timezone.now())
+
+        if count:
+            Post.objects.link_neighbours(blog=self.blog)
+            bump_blog_version(self.blog.pk)
+        return count
+
     @property
     def last_sync(self):
-        modified = time.ctime(os.path.getmtime(self.blog.backend_file))
-        return make_aware(parse(modified), utc)
+        path = self.blog.backend_file
+        if os.path.isdir(path):
+            # A directory's own modified time misses changes to its files,
+            # the manifest tracks them instead
+            return timezone.now()
+
+        return datetime.datetime.fromtimestamp(os.path.getmtime(path), utc)
+
+
+def get_file_stat(file_stat):
+    """
+    The size, modified time in nanoseconds and inode of a file. Manifests
+    add the stardate read from the file to these.
+    """
+    mtime_ns = getattr(file_stat, 'st_mtime_ns', None)
+    if mtime_ns is None:
+        # Python<3.3
+        mtime_ns = int(file_stat.st_mtime * 1e9)
+    return [file_stat.st_size, mtime_ns, file_stat.st_ino]
@@ -0,0 +1,166 @@
+import hashlib
+import time
+
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Case, Count, Max, When
+from django.utils import timezone
+from django.views.decorators.http import condition
+
+# Seconds public pages are cached for, None turns the response cache off
+RESPONSE_CACHE_TIMEOUT = getattr(settings, 'STARDATE_RESPONSE_CACHE_TIMEOUT', None)
+
+
+def blog_version_key(blog_id):
+    return 'stardate:version:{0}'.format(blog_id)
+
+
+def get_blog_version(blog_id):
+    """
+    Return the version a blog's cached pages are stored under
+    """
+    key = blog_version_key(blog_id)
+    version = cache.get(key)
+
+    if version is None:
+        # Start from the time so an evicted version is never reused
+        cache.add(key, int(time.time() * 1000), None)
+        version = cache.get(key)
+    return version
+
+
+def bump_blog_version(blog_id):
+    """
+    Move a blog on to a new version, which leaves every page cached under
+    the old one behind
+    """
+    if RESPONSE_CACHE_TIMEOUT is None or blog_id is None:
+        return
+
+    try:
+        cache.incr(blog_version_key(blog_id))
+    except ValueError:
+        get_blog_version(blog_id)
+
+
+def response_cache_key(blog_id, request):
+    path_hash = hashlib.md5(request.get_full_path().encode('utf-8')).hexdigest()
+    return 'stardate:response:{0}:{1}:{2}'.format(
+        blog_id, get_blog_version(blog_id), path_hash)
+
+
+def is_anonymous(request):
+    user = getattr(request, 'user', None)
+    if user is None:
+        return True
+    authenticated = user.is_authenticated
+    if callable(authenticated):
+        # Django<1.10
+        authenticated = authenticated()
+    return not authenticated
+
+
+def cache_blog_response(view):
+    """
+    Cache the anonymous GET responses of a view of a blog, keyed by the
+    blog's version
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        from stardate.models import Blog
+
+        if RESPONSE_CACHE_TIMEOUT is None or request.method != 'GET' or \
+                not is_anonymous(request):
+            return view(request, *args, **kwargs)
+
+        try:
+            blog = Blog.objects.get_by_slug(kwargs['blog_slug'])
+        except (KeyError, Blog.DoesNotExist):
+            return view(request, *args, **kwargs)
+
+        key = response_cache_key(blog.pk, request)
+        response = cache.get(key)
+        if response is not None:
+            return response
+
+        response = view(request, *args, **kwargs)
+
+        if response.status_code == 200 and not response.streaming:
+            def store(response):
+                cache.set(key, response, RESPONSE_CACHE_TIMEOUT)
+
+            if hasattr(response, 'add_post_render_callback'):
+                response.add_post_render_callback(store)
+            else:
+                store(response)
+        return response
+    return wrapper
+
+
+def get_blog_state(request, blog_slug=None, **kwargs):
+    """
+    Return the ETag and last modified time of a blog's pages from a single
+    aggregate query, which is kept on the request for both to use
+    """
+    state = getattr(request, '_stardate_blog_state', None)
+    if state is not None:
+        return state
+
+    from stardate.models import Blog
+
+    try:
+        blog = Blog.objects.get_by_slug(blog_slug)
+    except Blog.DoesNotExist:
+        state = (None, None)
+    else:
+        state = get_cached_blog_state(blog)
+
+    request._stardate_blog_state = state
+    return state
+
+
+def get_cached_blog_state(blog):
+    """
+    Work out a blog's state, cached under its version like its pages are
+    when the response cache is on
+    """
+    if RESPONSE_CACHE_TIMEOUT is not None:
+        key = 'stardate:state:{0}:{1}'.format(blog.pk, get_blog_version(blog.pk))
+        state = cache.get(key)
+        if state is None:
+            state = query_blog_state(blog)
+            cache.set(key, state, RESPONSE_CACHE_TIMEOUT)
+        return state
+    return query_blog_state(blog)
+
+
+def query_blog_state(blog):
+    # A scheduled post going live changes pages without a save
+    values = blog.posts.aggregate(
+        count=Count('pk'),
+        modified=Max('modified'),
+        published=Max(Case(When(publish__lte=timezone.now(), then='publish'))),
+    )
+    etag = u'{0}:{1}:{2}:{3}:{4}:{5}'.format(
+        blog.pk, blog.slug, blog.name,
+        values['count'], values['modified'], values['published'])
+    etag = hashlib.md5(etag.encode('utf-8')).hexdigest()
+
+    last_modified = max(
+        [value for value in (values['modified'], values['published']) if value] or [None])
+    return etag, last_modified
+
+
+def blog_etag(request, *args, **kwargs):
+    return get_blog_state(request, **kwargs)[0]
+
+
+def blog_last_modified(request, *args, **kwargs):
+    return get_blog_state(request, **kwargs)[1]
+
+
+# Answer conditional GETs for a blog's pages with a 304 when nothing changed
+conditional_blog_response = condition(
+    etag_func=blog_etag, last_modified_func=blog_last_modified)
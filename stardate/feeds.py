@@ -1,6 +1,8 @@
 from django.contrib.syndication.views import Feed
-from django.shortcuts import get_object_or_404
+from django.http import Http404
+from django.utils.decorators import method_decorator
 
+from stardate.caching import cache_blog_response, conditional_blog_response
 from stardate.models import Blog
 from stardate.utils import get_post_model
 
@@ -8,8 +10,20 @@ Post = get_post_model()
 
 
 class LatestPostsFeed(Feed):
+    @method_decorator(conditional_blog_response)
+    @method_decorator(cache_blog_response)
+    def __call__(self, request, *args, **kwargs):
+        response = super(LatestPostsFeed, self).__call__(request, *args, **kwargs)
+        # The feed's own header only follows publish dates, the blog's
+        # last modified time also covers edits
+        del response['Last-Modified']
+        return response
+
     def get_object(self, request, blog_slug):
-        return get_object_or_404(Blog, slug=blog_slug)
+        try:
+            return Blog.objects.get_by_slug(blog_slug)
+        except Blog.DoesNotExist:
+            raise Http404
 
     def title(self, obj):
         return "%s: Recent posts" % obj.name
@@ -18,7 +32,7 @@ class LatestPostsFeed(Feed):
         return obj.get_absolute_url()
 
     def items(self, obj):
-        return Post.objects.published().filter(blog=obj)[:5]
+        return obj.posts.published_list(rendered=True)[:5]
 
     def item_title(self, item):
         return item.title
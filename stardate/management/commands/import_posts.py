@@ -12,6 +12,7 @@ class Command(BaseCommand):
     """
     Usage:
     ./manage.py import_posts --user [username] --user [otheruser]
+    ./manage.py import_posts --no-write-back
 
     When importing posts from the backend, a backend should check that
     there is new data on the backend itself, if there is new data, then
@@ -21,6 +22,14 @@ class Command(BaseCommand):
     def add_arguments(self, parser):
         parser.add_argument('--force', action='store_true', dest='force')
 
+        parser.add_argument(
+            '--no-write-back',
+            action='store_false',
+            dest='write_back',
+            default=True,
+            help='Never write pulled posts back to the backend'
+        )
+
         parser.add_argument(
             '--user',
             action='append',
@@ -41,4 +50,4 @@ class Command(BaseCommand):
             for blog in Blog.objects.filter(user=user):
                 logger.info(u'Updating posts for {0}'.format(blog))
 
-                blog.backend.pull(force=force)
+                blog.backend.pull(force=force, write_back=options['write_back'])
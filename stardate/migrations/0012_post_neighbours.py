@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def link_posts(apps, schema_editor):
+    # Chain each blog's published, non-deleted posts in publish order. The
+    # links were just added, so only posts in a chain need updating.
+    Post = apps.get_model('stardate', 'Post')
+    rows = Post.objects.order_by('blog_id', 'publish', 'pk').values_list(
+        'pk', 'blog_id', 'publish', 'deleted')
+
+    chains = {}
+    for pk, blog_id, publish, deleted in rows:
+        if publish and not deleted:
+            chains.setdefault(blog_id, []).append(pk)
+
+    for pks in chains.values():
+        for prev_id, pk, next_id in zip([None] + pks[:-1], pks, pks[1:] + [None]):
+            Post.objects.filter(pk=pk).update(prev_post=prev_id, next_post=next_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stardate', '0011_auto_20170523_0211'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='next_post',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='stardate.Post'),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='prev_post',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='stardate.Post'),
+        ),
+        migrations.RunPython(link_posts, migrations.RunPython.noop),
+    ]
@@ -1,18 +1,26 @@
 import datetime
+import hashlib
 import uuid
 
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.core import serializers
+from django.core.cache import cache
 from django.db import models
+from django.db.models.signals import post_delete, post_save
 from django.db.models.query import QuerySet
 from django.template.defaultfilters import slugify
 from django.utils import timezone
 
-from dateutil import tz
+try:
+    from django.db.transaction import atomic
+except ImportError:
+    from django.db.transaction import commit_on_success as atomic
+
 from markupfield.fields import MarkupField
 
-from stardate.utils import get_post_model
+from stardate.caching import bump_blog_version
+from stardate.utils import get_post_model, get_timezone
 
 SERIALIZED_FIELDS = (
     'title',
@@ -22,6 +30,34 @@ SERIALIZED_FIELDS = (
     'timezone'
 )
 
+# Seconds a blog looked up by slug stays cached
+BLOG_CACHE_TIMEOUT = getattr(settings, 'STARDATE_BLOG_CACHE_TIMEOUT', 60 * 60)
+
+
+def blog_cache_key(slug):
+    slug_hash = hashlib.md5(slug.lower().encode('utf-8')).hexdigest()
+    return 'stardate:blog:{0}'.format(slug_hash)
+
+
+class BlogManager(models.Manager):
+    def get_by_slug(self, slug):
+        """
+        Return the blog with ``slug``, matched case insensitively. Blogs are
+        cached until they are saved or deleted.
+        """
+        slug = slug.lower()
+        key = blog_cache_key(slug)
+        blog = cache.get(key)
+
+        if blog is None:
+            try:
+                blog = self.get(slug=slug)
+            except self.model.DoesNotExist:
+                # Slugs that were saved with capitals
+                blog = self.get(slug__iexact=slug)
+            cache.set(key, blog, BLOG_CACHE_TIMEOUT)
+        return blog
+
 
 class Blog(models.Model):
     authors = models.ManyToManyField(User, blank=True)
@@ -36,16 +72,36 @@ class Blog(models.Model):
     slug = models.SlugField(unique=True)
     sync = models.BooleanField(default=True,
         help_text='This blog should sync using it\'s selected backend')
+    # Backend state kept between pulls, such as a manifest of post files
+    sync_state = models.TextField(blank=True, editable=False)
+
+    objects = BlogManager()
 
 
     def __unicode__(self):
         return self.name
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        blog = super(Blog, cls).from_db(db, field_names, values)
+        # The slug the blog is cached under if it is renamed
+        blog._loaded_slug = blog.__dict__.get('slug')
+        return blog
+
     @property
     def backend(self):
+        """
+        The blog's backend instance, built once per blog instance and rebuilt
+        if ``backend_class`` changes.
+        """
         from stardate.backends import get_backend
 
-        return get_backend(self.backend_class, blog=self)
+        backend = getattr(self, '_backend', None)
+        if backend is None or self._backend_class != self.backend_class:
+            backend = get_backend(self.backend_class, blog=self)
+            self._backend = backend
+            self._backend_class = self.backend_class
+        return backend
 
     def clean(self, *args, **kwargs):
         if not self.slug:
@@ -90,7 +146,40 @@ class Blog(models.Model):
             logger.info('Saved: {}'.format(p.title))
 
 
+def invalidate_blog_cache(sender, instance, **kwargs):
+    slugs = set([instance.slug, getattr(instance, '_loaded_slug', None)])
+    cache.delete_many([blog_cache_key(slug) for slug in slugs if slug])
+    instance._loaded_slug = instance.slug
+    bump_blog_version(instance.pk)
+
+
+post_save.connect(invalidate_blog_cache, sender=Blog)
+post_delete.connect(invalidate_blog_cache, sender=Blog)
+
+
+class PostQuerySet(QuerySet):
+    def delete(self):
+        """
+        Delete the posts and relink the blogs they were in, as
+        ``Post.delete`` does for one post
+        """
+        blog_ids = set(self.order_by().values_list('blog_id', flat=True).distinct())
+        deleted = super(PostQuerySet, self).delete()
+        for blog_id in blog_ids:
+            self.model.objects.link_neighbours(blog=blog_id)
+            bump_blog_version(blog_id)
+        return deleted
+
+    delete.alters_data = True
+
+
 class PostManager(models.Manager):
+    def get_queryset(self):
+        return PostQuerySet(self.model, using=self._db)
+
+    # Django<1.6
+    get_query_set = get_queryset
+
     def drafts(self):
         """
         Returns all draft Post instances. A draft is considered to be a Post
@@ -113,35 +202,124 @@ class PostManager(models.Manager):
             deleted=False,
             publish__lte=timezone.now()).order_by('-publish')
 
+    def published_list(self, rendered=False):
+        """
+        Published posts for list pages. Bodies are left out and blogs are
+        joined, so each post's URL needs no further queries. Pass
+        ``rendered=True`` to keep the rendered body, as feeds show it.
+        """
+        deferred = ['body'] if rendered else ['body', '_body_rendered']
+        return self.published().defer(*deferred).select_related('blog')
+
+    def link_neighbours(self, blog=None):
+        """
+        Stores each post's previous and next neighbours so that detail pages
+        don't have to query for them. Returns the number of posts relinked.
+        """
+        try:
+            queryset_method = self.get_queryset
+        except AttributeError:
+            queryset_method = self.get_query_set
+
+        queryset = queryset_method()
+        if blog is not None:
+            queryset = queryset.filter(blog=blog)
+
+        return link_neighbours(queryset)
+
+
+def link_neighbours(queryset):
+    """
+    Chain the posts in a queryset by publish order, per blog. Scheduled posts
+    are part of the chain and are skipped at read time, so the links stay
+    correct as posts go live. Only posts whose links changed are updated.
+    """
+    rows = queryset.order_by('blog_id', 'publish', 'pk').values_list(
+        'pk', 'blog_id', 'publish', 'deleted', 'prev_post_id', 'next_post_id')
+
+    current = {}
+    chain = []
+    for pk, blog_id, publish, deleted, prev_id, next_id in rows:
+        current[pk] = (prev_id, next_id)
+        if publish and not deleted:
+            chain.append((blog_id, pk))
+
+    links = dict((pk, [None, None]) for pk in current)
+    for (prev_blog, prev_id), (next_blog, next_id) in zip(chain, chain[1:]):
+        if prev_blog == next_blog:
+            links[prev_id][1] = next_id
+            links[next_id][0] = prev_id
+
+    changed = [(pk, link) for pk, link in links.items()
+               if current[pk] != tuple(link)]
+
+    values = {}
+    if any(f.name == 'modified' for f in queryset.model._meta.concrete_fields):
+        # New neighbours change the post's page. Models from migrations
+        # before 0015 have no modified field.
+        values['modified'] = timezone.now()
+
+    if hasattr(queryset, 'bulk_update'):
+        # Django>=2.2
+        queryset.bulk_update([
+            queryset.model(pk=pk, prev_post_id=prev_id, next_post_id=next_id, **values)
+            for pk, (prev_id, next_id) in changed
+        ], ['prev_post', 'next_post'] + list(values))
+    else:
+        with atomic():
+            for pk, (prev_id, next_id) in changed:
+                queryset.filter(pk=pk).update(
+                    prev_post=prev_id, next_post=next_id, **values)
+    return len(changed)
+
 
 class BasePost(models.Model):
     authors = models.ManyToManyField(User, blank=True, related_name="%(app_label)s_%(class)s_related")
     blog = models.ForeignKey(Blog, related_name="%(app_label)s_%(class)s_related")
-    body = MarkupField(blank=True, default_markup_type='markdown')
     created = models.DateTimeField(default=timezone.now)
     deleted = models.BooleanField(default=False)
+    # Last change to the post or its neighbours, set by saves and pulls
+    modified = models.DateTimeField(auto_now=True)
     objects = PostManager()
     publish = models.DateTimeField(blank=True, null=True)
     slug = models.SlugField()
     stardate = models.CharField(max_length=255)
     title = models.CharField(max_length=255)
     timezone = models.CharField(blank=True, max_length=255, default=settings.TIME_ZONE)
+    # Denormalized neighbours, maintained by PostManager.link_neighbours
+    prev_post = models.ForeignKey('self', blank=True, null=True, editable=False,
+        on_delete=models.SET_NULL, related_name='+')
+    next_post = models.ForeignKey('self', blank=True, null=True, editable=False,
+        on_delete=models.SET_NULL, related_name='+')
+    # Declared last: MarkupField numbers its markup type and rendered fields
+    # after it, and Django compares fields by that number, so any field
+    # declared just after it would be mixed up with them by defer()/only()
+    body = MarkupField(blank=True, default_markup_type='markdown')
 
     class Meta:
         abstract = True
         app_label = 'stardate'
+        # Subclasses that declare their own Meta should extend this one
+        # to keep the indexes below
+        index_together = (
+            # PostManager.published() for a blog
+            ('blog', 'deleted', 'publish'),
+            # Matching remote posts during a pull
+            ('blog', 'stardate'),
+        )
         ordering = ['-publish']
         unique_together = ('blog', 'slug')
 
-    def __init__(self, *args, **kwargs):
-        super(BasePost, self).__init__(*args, **kwargs)
-        # Post must use the same backend as the Blog
-        if hasattr(self, 'blog'):
-            self.backend = self.blog.backend
-
     def __unicode__(self):
         return self.title
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        post = super(BasePost, cls).from_db(db, field_names, values)
+        # The fields that place the post in its blog's chain, as loaded
+        post._loaded_chain = (post.__dict__.get('publish'), post.__dict__.get('deleted'))
+        return post
+
     def clean(self, *args, **kwargs):
         if not self.stardate:
             self.stardate = str(uuid.uuid1())
@@ -152,14 +330,27 @@ class BasePost(models.Model):
         if not self.body.raw.endswith('\n'):
             self.body.raw += '\n'
 
+    @property
+    def backend(self):
+        """
+        Post must use the same backend as the Blog. It is resolved on first
+        use so that read-only querysets don't build a backend for every row.
+        """
+        try:
+            return self._backend
+        except AttributeError:
+            self._backend = self.blog.backend
+            return self._backend
+
+    @backend.setter
+    def backend(self, backend):
+        self._backend = backend
+
     def mark_deleted(self):
         self.deleted = True
         return self
 
     def save(self, push=True, *args, **kwargs):
-        if not hasattr(self, 'backend'):
-            self.backend = self.blog.backend
-
         # Validate first so things don't break on push
         # self.full_clean()
         self.clean()
@@ -183,13 +374,35 @@ class BasePost(models.Model):
             self.backend.push([self])
         super(BasePost, self).save(*args, **kwargs)
 
+        # Only new posts and changes to publish or deleted move the chain
+        chain = (self.publish, self.deleted)
+        if getattr(self, '_loaded_chain', None) != chain:
+            if self.__class__.objects.link_neighbours(blog=self.blog_id):
+                self.refresh_from_db(fields=['prev_post', 'next_post'])
+            self._loaded_chain = chain
+        bump_blog_version(self.blog_id)
+
+    def delete(self, *args, **kwargs):
+        blog_id = self.blog_id
+        deleted = super(BasePost, self).delete(*args, **kwargs)
+        self.__class__.objects.link_neighbours(blog=blog_id)
+        bump_blog_version(blog_id)
+        return deleted
+
     def serialized(self):
         serialized = serializers.serialize('python', [self], fields=SERIALIZED_FIELDS)
 
         for s in serialized:
-            if s['fields']['publish']:
+            publish = s['fields']['publish']
+            if publish:
+                if timezone.is_aware(publish):
+                    # Convert rather than replace, so a post loaded from
+                    # the database keeps its publish time on push
+                    publish = publish.astimezone(get_timezone(self.timezone))
+                else:
+                    publish = publish.replace(tzinfo=get_timezone(self.timezone))
                 s['fields']['publish'] = datetime.datetime.strftime(
-                    s['fields']['publish'].replace(tzinfo=tz.gettz(self.timezone)),
+                    publish,
                     '%Y-%m-%d %I:%M %p %z'
                 )
 
@@ -221,23 +434,18 @@ class BasePost(models.Model):
             }
         )
 
-    def get_next_post(self):
-        if not self.publish:
+    def _get_neighbour(self, post):
+        if not self.publish or not post or post.publish > timezone.now():
             return False
-        next = self.blog.posts.filter(publish__gt=self.publish).exclude(
-            id__exact=self.id).order_by('publish')
-        if next:
-            return next[0]
-        return False
+        if post.blog_id == self.blog_id:
+            post.blog = self.blog
+        return post
+
+    def get_next_post(self):
+        return self._get_neighbour(self.next_post)
 
     def get_prev_post(self):
-        if not self.publish:
-            return False
-        prev = self.blog.posts.filter(publish__lt=self.publish).exclude(
-                id__exact=self.id).order_by('-publish')
-        if prev:
-            return prev[0]
-        return False
+        return self._get_neighbour(self.prev_post)
 
     @property
     def is_draft(self):
@@ -0,0 +1,99 @@
+import datetime
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils.timezone import is_aware, utc
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=utc)
+
+# Largest id a database will compare against, a signed 64-bit integer
+MAX_PK = 2 ** 63 - 1
+
+
+def encode_cursor(post):
+    """
+    A post's position in publish order, as microseconds since the epoch and
+    its id
+    """
+    epoch = EPOCH if is_aware(post.publish) else EPOCH.replace(tzinfo=None)
+    delta = post.publish - epoch
+    micros = (delta.days * 86400 + delta.seconds) * 10 ** 6 + delta.microseconds
+    return '{0}.{1}'.format(micros, post.pk)
+
+
+def decode_cursor(cursor):
+    """
+    Return the publish date and id in a cursor, raising ValueError for
+    anything else
+    """
+    micros, pk = cursor.split('.')
+    pk = int(pk)
+    if not 0 <= pk <= MAX_PK:
+        raise ValueError('Cursor id out of range: {0}'.format(cursor))
+
+    epoch = EPOCH if settings.USE_TZ else EPOCH.replace(tzinfo=None)
+    try:
+        return epoch + datetime.timedelta(microseconds=int(micros)), pk
+    except OverflowError:
+        # Past the dates datetime can hold
+        raise ValueError('Cursor out of range: {0}'.format(cursor))
+
+
+class KeysetPage(object):
+    """
+    A page of posts that starts after or ends before a cursor, with the
+    same ``has_next`` and ``has_previous`` API as Django's Page
+    """
+    def __init__(self, object_list, has_next, has_previous):
+        self.object_list = object_list
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+    @property
+    def next_cursor(self):
+        if self._has_next:
+            return encode_cursor(self.object_list[-1])
+
+    @property
+    def previous_cursor(self):
+        if self._has_previous:
+            return encode_cursor(self.object_list[0])
+
+
+def paginate_keyset(queryset, page_size, after=None, before=None):
+    """
+    Return the page of ``queryset``, newest first, that follows the ``after``
+    cursor or precedes the ``before`` one. Pages are found by seeking on
+    (publish, id), so deep pages cost the same as the first.
+    """
+    if before:
+        publish, pk = decode_cursor(before)
+        posts = list(queryset.filter(
+            Q(publish__gt=publish) | Q(publish=publish, pk__gt=pk)
+        ).order_by('publish', 'pk')[:page_size + 1])
+        has_previous = len(posts) > page_size
+        posts = posts[:page_size][::-1]
+        return KeysetPage(posts, True, has_previous)
+
+    if after:
+        publish, pk = decode_cursor(after)
+        queryset = queryset.filter(
+            Q(publish__lt=publish) | Q(publish=publish, pk__lt=pk))
+
+    posts = list(queryset.order_by('-publish', '-pk')[:page_size + 1])
+    return KeysetPage(posts[:page_size], len(posts) > page_size, bool(after))
@@ -1,26 +1,260 @@
+import codecs
 import datetime
+import hashlib
 import logging
 import pytz
+import re
+import threading
+import time
 import types
 import yaml
 
+from collections import OrderedDict
+
+from django.conf import settings
 from django.utils.timezone import is_aware, make_aware, utc
 
 from dateutil import tz
 from dateutil.parser import parse
 
 from stardate.backends import BaseStardateParser
+from stardate.utils import get_timezone
+
+try:
+    from yaml import CFullLoader as YAMLLoader
+except ImportError:
+    try:
+        from yaml import FullLoader as YAMLLoader
+    except ImportError:
+        # PyYAML<5.1
+        from yaml import Loader as YAMLLoader
 
 logger = logging.getLogger(__name__)
 
 DELIMITER = "\n---\n\n"
 TIMEFORMAT = '%Y-%m-%d %I:%M %p'  # 2012-01-01 09:00 AM
 
+# Most parsed segments of blog files kept in memory
+PARSE_CACHE_SIZE = getattr(settings, 'STARDATE_PARSE_CACHE_SIZE', 1000)
+
+# Alias of a Django cache parsed segments are also kept in, if any
+PARSE_CACHE_ALIAS = getattr(settings, 'STARDATE_PARSE_CACHE_ALIAS', None)
+
+# Seconds parsed segments are kept in the Django cache
+PARSE_CACHE_TIMEOUT = getattr(settings, 'STARDATE_PARSE_CACHE_TIMEOUT', 60 * 60 * 24 * 7)
+
+# A publish date as written by render, ``TIMEFORMAT`` with an optional offset
+PUBLISH_DATE = re.compile(
+    r'^(\d{4})-(\d{2})-(\d{2}) (0[1-9]|1[0-2]):([0-5]\d) ([AP]M)'
+    r'(?: ([+-])([01]\d|2[0-3])([0-5]\d))?$'
+)
+
+# Characters read from a file object at a time when unpacking
+CHUNK_SIZE = 64 * 1024
+
+# Most segments of a blog file looked up in the parse cache at once
+CACHE_BATCH_SIZE = 100
+
+# A flat ``key: value`` front matter line
+FLAT_LINE = re.compile(r'^([A-Za-z_][A-Za-z0-9_]*):(?: +(.*?))? *$')
+
+# Characters that give a YAML scalar a special meaning at its start
+YAML_INDICATORS = set('-?:,[]{}#&*!|>\'"%@`')
+
+try:
+    string_types = (basestring,)
+except NameError:
+    string_types = (str, bytes)
+
+
+def iter_chunks(source, size=CHUNK_SIZE):
+    """
+    Iterate over a string, a file object or an iterable of chunks
+    """
+    if isinstance(source, string_types):
+        yield source
+    elif hasattr(source, 'read'):
+        chunk = source.read(size)
+        while chunk:
+            yield chunk
+            chunk = source.read(size)
+    else:
+        for chunk in source:
+            yield chunk
+
+
+def is_plain_string(value):
+    """
+    Whether YAML would load ``value`` as the same plain string
+    """
+    if not value or value[0] in YAML_INDICATORS:
+        return False
+
+    if ': ' in value or ' #' in value or value.endswith(':'):
+        return False
+
+    if '\t' in value or '\r' in value:
+        return False
+
+    # Anything YAML would resolve to a bool, number, date or null
+    resolvers = YAMLLoader.yaml_implicit_resolvers
+    for tag, regexp in resolvers.get(value[0], []) + resolvers.get(None, []):
+        if regexp.match(value):
+            return False
+    return True
+
+
+def parse_datetime(string):
+    """
+    Parse a date string the way ``dateutil.parser.parse`` does, without
+    dateutil for dates in the format stardate writes
+    """
+    match = PUBLISH_DATE.match(string) if isinstance(string, string_types) else None
+    if match is None:
+        return parse(string)
+
+    year, month, day, hour, minute, meridian, sign, offset_h, offset_m = match.groups()
+    hour = int(hour) % 12
+    if meridian == 'PM':
+        hour += 12
+
+    try:
+        date = datetime.datetime(int(year), int(month), int(day), hour, int(minute))
+    except ValueError:
+        # Let dateutil raise its own error
+        return parse(string)
+
+    if sign:
+        offset = (int(offset_h) * 60 + int(offset_m)) * 60
+        if not offset:
+            # dateutil names a zero offset UTC, which is local time on a
+            # machine set to UTC
+            date = date.replace(tzinfo=tz.tzlocal() if 'UTC' in time.tzname else tz.tzutc())
+        else:
+            date = date.replace(tzinfo=tz.tzoffset(None, -offset if sign == '-' else offset))
+    return date
+
+
+def load_front_matter(string):
+    """
+    Load a post's meta data block. Flat ``key: value`` lines, as written by
+    ``FileParser.render``, are split directly; anything else is loaded as
+    YAML, with the libyaml loader when it is available.
+    """
+    data = {}
+
+    for line in string.split('\n'):
+        if not line:
+            continue
+
+        match = FLAT_LINE.match(line)
+        if not match or not is_plain_string(match.group(1)) or \
+                not is_plain_string(match.group(2)):
+            return yaml.load(string, Loader=YAMLLoader)
+
+        key, value = match.groups()
+        data[key] = value
+    return data
+
+
+class ParseCache(object):
+    """
+    Parsed post dictionaries keyed by a hash of the text they were parsed
+    from. The most recently used ``size`` are kept in memory, and every one
+    is kept in the Django cache named by ``alias`` for ``timeout`` seconds
+    when it is set.
+    """
+    def __init__(self, size=PARSE_CACHE_SIZE, alias=PARSE_CACHE_ALIAS,
+                 timeout=PARSE_CACHE_TIMEOUT):
+        self.size = size
+        self.alias = alias
+        self.timeout = timeout
+        self.posts = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {
+            'hits': 0,
+            'misses': 0,
+        }
+
+    def key(self, string, version=None):
+        # A new parser version parses the same text differently
+        if not isinstance(string, bytes):
+            string = string.encode('utf-8')
+        return 'stardate:parse:{0}:{1}'.format(version, hashlib.sha1(string).hexdigest())
+
+    def get_cache(self):
+        if self.alias is None:
+            return None
+        from django.core.cache import caches
+        return caches[self.alias]
+
+    def get(self, key):
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys):
+        """
+        Return a dictionary of the posts cached under ``keys``. Those not in
+        memory are looked up in one call to the Django cache.
+        """
+        found = {}
+        with self.lock:
+            for key in keys:
+                post = self.posts.pop(key, None)
+                if post is not None:
+                    self.posts[key] = post
+                    found[key] = post
+
+        missing = [key for key in keys if key not in found]
+        if missing and self.alias is not None:
+            for key, post in self.get_cache().get_many(missing).items():
+                self._remember(key, post)
+                found[key] = post
+
+        with self.lock:
+            hits = sum(1 for key in keys if key in found)
+            self.stats['hits'] += hits
+            self.stats['misses'] += len(keys) - hits
+
+        # Callers are free to change the dictionaries they get
+        return dict((key, dict(post)) for key, post in found.items())
+
+    def set(self, key, post):
+        self.set_many({key: post})
+
+    def set_many(self, posts):
+        """
+        Cache a dictionary of posts by key, in one call to the Django cache
+        """
+        posts = dict((key, dict(post)) for key, post in posts.items())
+        for key, post in posts.items():
+            self._remember(key, post)
+        if self.alias is not None:
+            self.get_cache().set_many(posts, self.timeout)
+
+    def _remember(self, key, post):
+        with self.lock:
+            self.posts.pop(key, None)
+            self.posts[key] = post
+            while len(self.posts) > self.size:
+                self.posts.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.posts.clear()
+            self.stats['hits'] = self.stats['misses'] = 0
+
+
+parse_cache = ParseCache()
+
 
 class FileParser(BaseStardateParser):
-    def __init__(self):
+    # Bump when parsing changes, so snapshots of parsed posts are discarded
+    version = 1
+
+    def __init__(self, cache=None):
         self.delimiter = DELIMITER
         self.timeformat = TIMEFORMAT
+        self.cache = parse_cache if cache is None else cache
 
     def render(self, post):
         """
@@ -79,7 +313,7 @@ class FileParser(BaseStardateParser):
             return None
 
         # load meta data into post dictionary
-        post_data = yaml.load(bits[0]) or {}
+        post_data = load_front_matter(bits[0]) or {}
 
         # post body is everything else
         # Join incase other parts of post are separated
@@ -108,10 +342,12 @@ class FileParser(BaseStardateParser):
             date = datetime.datetime.combine(date, datetime.datetime.min.time())
 
         if not isinstance(date, datetime.datetime):
-            date = parse(date)
+            date = parse_datetime(date)
+
+        tzinfo = get_timezone(timezone) if timezone else None
 
         if not is_aware(date) and timezone:
-            date = date.replace(tzinfo=tz.gettz(timezone))
+            date = date.replace(tzinfo=tzinfo)
 
         if not is_aware(date):
             try:
@@ -121,8 +357,8 @@ class FileParser(BaseStardateParser):
                 # Django<1.8
                 date = make_aware(date, utc)
 
-        if timezone and date.tzinfo != tz.gettz(timezone):
-            date = date.replace(tzinfo=tz.gettz(timezone))
+        if timezone and date.tzinfo != tzinfo:
+            date = date.replace(tzinfo=tzinfo)
 
         return date
 
@@ -130,10 +366,105 @@ class FileParser(BaseStardateParser):
         """
         Returns a list of parsed post dictionaries.
         """
-        parsed_list = []
+        return list(self.iter_unpack(string))
+
+    def iter_unpack(self, source):
+        """
+        Yield parsed post dictionaries one at a time from a string, a file
+        object or an iterable of text or utf-8 encoded chunks. Only the post
+        being read is kept in memory.
+        """
+        for start, end, post in self.iter_spans(source):
+            if post:
+                yield post
+
+    def iter_spans(self, source):
+        """
+        Yield a ``(start, end, post)`` tuple for every delimited segment of
+        ``source``: the offsets of the segment in the decoded text and its
+        post dictionary, or None if it doesn't parse.
 
-        for post in string.split(self.delimiter):
-            parsed = self.parse(post)
-            if parsed:
-                parsed_list.append(parsed)
-        return parsed_list
+        Segments past the first ``cache.size`` of a file are parsed without
+        the in-memory cache. A file larger than the cache would otherwise
+        evict every segment before it is read again.
+        """
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        delimiter = self.delimiter
+        buffer = ''
+        # Offset of the start of the buffer in the whole text
+        offset = 0
+        # Segments left that the in-memory cache can hold, None when a
+        # Django cache backs it
+        cached = self.cache.size if self.cache.alias is None else None
+
+        for chunk in iter_chunks(source):
+            if isinstance(chunk, bytes) and not isinstance(chunk, str):
+                chunk = decoder.decode(chunk)
+
+            # A delimiter may straddle the previous chunk
+            start = max(len(buffer) - len(delimiter) + 1, 0)
+            buffer += chunk
+            # Start of the segment being read in the buffer
+            position = 0
+
+            # Segments read but not yet parsed, parsed a batch at a time
+            spans = []
+
+            index = buffer.find(delimiter, start)
+            while index >= 0:
+                spans.append((offset + position, offset + index, buffer[position:index]))
+                position = index + len(delimiter)
+                index = buffer.find(delimiter, position)
+
+                if len(spans) == CACHE_BATCH_SIZE or index < 0:
+                    for span in self._parse_spans(spans, cached):
+                        yield span
+                    if cached:
+                        cached = max(cached - len(spans), 0)
+                    spans = []
+
+            # Drop the segments read from the buffer once per chunk, rather
+            # than copying the rest of it after every segment
+            if position:
+                offset += position
+                buffer = buffer[position:]
+
+        tail = decoder.decode(b'', final=True)
+        if tail:
+            buffer += tail
+        for span in self._parse_spans([(offset, offset + len(buffer), buffer)], cached):
+            yield span
+
+    def _parse_spans(self, spans, cached):
+        strings = [string for start, end, string in spans]
+        posts = self.parse_segments(strings, cached)
+        return [(start, end, post) for (start, end, string), post in zip(spans, posts)]
+
+    def parse_segments(self, strings, cached=None):
+        """
+        Parse segments of a blog file, reusing the results for segments that
+        were parsed before. Only the first ``cached`` segments go through the
+        cache, or all of them when it is None. The cache is read and written
+        once per call.
+        """
+        if cached is None:
+            cached = len(strings)
+        keys = [self.cache.key(string, self.version) for string in strings[:cached]]
+        found = self.cache.get_many(keys) if keys else {}
+
+        posts = []
+        parsed = {}
+        for i, string in enumerate(strings):
+            key = keys[i] if i < cached else None
+            if key in found:
+                # The same segment may appear twice in a batch
+                post = dict(found[key])
+            else:
+                post = self.parse(string)
+                if key is not None and isinstance(post, dict):
+                    parsed[key] = found[key] = post
+            posts.append(post)
+
+        if parsed:
+            self.cache.set_many(parsed)
+        return posts
@@ -1,5 +1,22 @@
+import os
+
 from django.core.exceptions import ImproperlyConfigured
 
+from dateutil import tz
+
+# Time zones already looked up by name
+_timezones = {}
+
+
+def get_timezone(name):
+    """
+    Return ``dateutil.tz.gettz(name)``, reading each zone only once
+    """
+    try:
+        return _timezones[name]
+    except KeyError:
+        return _timezones.setdefault(name, tz.gettz(name))
+
 
 def get_post_model():
     """
@@ -27,3 +44,18 @@ def get_post_model():
     if post_model is None:
         raise ImproperlyConfigured("STARDATE_POST_MODEL refers to model '%s' that has not been installed" % POST_MODEL)
     return post_model
+
+
+def setup_worker():
+    """
+    Set up Django in a spawned parse worker. Lives outside the backends so
+    workers can import it before the app registry is ready.
+    """
+    import django
+
+    try:
+        django.setup()
+    except Exception as e:
+        raise RuntimeError(u'Could not set up Django in a parse worker with '
+                           u'DJANGO_SETTINGS_MODULE={0!r}: {1!r}'.format(
+                               os.environ.get('DJANGO_SETTINGS_MODULE'), e))
@@ -20,13 +20,18 @@ from django.views.decorators.csrf import csrf_exempt
 from social_django.models import UserSocialAuth
 
 from stardate import backends
+from stardate.caching import cache_blog_response, conditional_blog_response
 from stardate.forms import BackendForm, BlogForm, PostForm
 from stardate.models import Blog
+from stardate.pagination import paginate_keyset
 from stardate.utils import get_post_model
 
 Post = get_post_model()
 logger = logging.getLogger('stardate')
 
+# Posts per page of the archives, None lists every post
+PAGINATE_BY = getattr(settings, 'STARDATE_PAGINATE_BY', 20)
+
 
 class BlogCreate(generic.edit.CreateView):
     form_class = BlogForm
@@ -62,9 +67,48 @@ class PostViewMixin(object):
     date_field = 'publish'
     slug_url_kwarg = 'post_slug'
 
+    def get_blog(self):
+        if not hasattr(self, 'blog'):
+            self.blog = Blog.objects.get_by_slug(self.kwargs['blog_slug'])
+        return self.blog
+
+    def get_queryset(self):
+        return self.get_blog().posts.published()
+
+
+class PostListMixin(PostViewMixin):
     def get_queryset(self):
-        blog = Blog.objects.get(slug__iexact=self.kwargs['blog_slug'])
-        return blog.posts.published()
+        return self.get_blog().posts.published_list()
+
+
+class CachedResponseMixin(object):
+    """
+    Answer conditional GETs from the blog's ETag and last modified time,
+    and cache anonymous responses until the blog changes when
+    ``STARDATE_RESPONSE_CACHE_TIMEOUT`` is set
+    """
+    @method_decorator(conditional_blog_response)
+    @method_decorator(cache_blog_response)
+    def dispatch(self, request, *args, **kwargs):
+        return super(CachedResponseMixin, self).dispatch(request, *args, **kwargs)
+
+
+class KeysetPaginationMixin(object):
+    """
+    Page through posts newest first with ``after`` and ``before`` cursors
+    rather than page numbers
+    """
+    paginate_by = PAGINATE_BY
+
+    def paginate_queryset(self, queryset, page_size):
+        try:
+            page = paginate_keyset(
+                queryset, page_size,
+                after=self.request.GET.get('after'),
+                before=self.request.GET.get('before'))
+        except ValueError:
+            raise Http404('Invalid page.')
+        return None, page, page.object_list, page.has_other_pages()
 
 
 class DraftViewMixin(object):
@@ -72,34 +116,46 @@ class DraftViewMixin(object):
         return Post.objects.drafts().filter(blog__user=self.request.user)
 
 
-class PostArchiveIndex(PostViewMixin, generic.ArchiveIndexView):
+class PostArchiveIndex(CachedResponseMixin, KeysetPaginationMixin, PostListMixin,
+        generic.ArchiveIndexView):
     context_object_name = 'post_list'
 
     def get_context_data(self, **kwargs):
         context = super(PostArchiveIndex, self).get_context_data(**kwargs)
-        context['blog'] = Blog.objects.get(slug__iexact=self.kwargs['blog_slug'])
+        context['blog'] = self.get_blog()
         return context
 
 
-class PostYearArchive(PostViewMixin, generic.YearArchiveView):
+class PostYearArchive(CachedResponseMixin, KeysetPaginationMixin, PostListMixin,
+        generic.YearArchiveView):
     make_object_list = True
 
 
-class PostMonthArchive(PostViewMixin, generic.MonthArchiveView):
+class PostMonthArchive(CachedResponseMixin, KeysetPaginationMixin, PostListMixin,
+        generic.MonthArchiveView):
     pass
 
 
-class PostDayArchive(PostViewMixin, generic.DayArchiveView):
+class PostDayArchive(CachedResponseMixin, KeysetPaginationMixin, PostListMixin,
+        generic.DayArchiveView):
     pass
 
 
-class PostDateDetail(PostViewMixin, generic.DateDetailView):
+class PostDateDetail(CachedResponseMixin, PostViewMixin, generic.DateDetailView):
     context_object_name = 'post'
 
+    def get_queryset(self):
+        queryset = super(PostDateDetail, self).get_queryset()
+        return queryset.select_related('prev_post', 'next_post')
+
 
-class PostDetail(PostViewMixin, generic.DetailView):
+class PostDetail(CachedResponseMixin, PostViewMixin, generic.DetailView):
     context_object_name = 'post'
 
+    def get_queryset(self):
+        queryset = super(PostDetail, self).get_queryset()
+        return queryset.select_related('prev_post', 'next_post')
+
 
 class DraftArchiveIndex(PostViewMixin, generic.ListView):
     template_name = 'stardate/draft_list.html'
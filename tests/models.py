@@ -9,5 +9,5 @@ class CustomPost(BasePost):
     """
     extra_field = models.CharField(max_length=255)
 
-    class Meta:
+    class Meta(BasePost.Meta):
         app_label = 'tests' # wat
@@ -1,16 +1,24 @@
 import datetime
+import json
 import os
+import pickle
 import tempfile
+import threading
+import time
 
 from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.test import TestCase
 from django.utils import timezone
 
 from dateutil.parser import parse
 from dropbox import Dropbox
+from dropbox.files import FileMetadata, FolderMetadata
 from mock import Mock, patch
 from social_django.models import UserSocialAuth
 
+from stardate.backends import (PushError, batch_save, get_parse_pool, load_snapshot,
+                               parse_pools, save_snapshot)
 from stardate.models import Blog
 from stardate.parsers import FileParser
 from stardate.backends.local_file import LocalFileBackend
@@ -23,6 +31,7 @@ def mock_get(path):
     tmp_file = open(path)
     mock_file = Mock()
     mock_file.content = tmp_file.read()
+    mock_file.iter_content.side_effect = lambda size: iter([mock_file.content])
 
     return ('meta', mock_file)
 
@@ -35,6 +44,11 @@ def mock_put(content, path, mode):
     }
 
 
+def list_folder_result(paths, cursor, has_more=False):
+    entries = [Mock(spec=FileMetadata, path_display=path) for path in paths]
+    return Mock(entries=entries, cursor=cursor, has_more=has_more)
+
+
 class MockMetadata:
     @property
     def server_modified(self):
@@ -70,6 +84,7 @@ class DropboxBackendTestCase(TestCase):
             }
         }
         UserSocialAuth.objects.create(**defaults)
+        cache.clear()
 
         blog = Blog.objects.create(
             name='Arbitrary',
@@ -99,6 +114,37 @@ class DropboxBackendTestCase(TestCase):
     def test_get_name(self):
         self.assertEqual(self.blog.backend.get_name(), 'dropbox')
 
+    def test_clients_are_shared(self):
+        from stardate.backends.dropbox import clients
+
+        clients.invalidate()
+        stats = dict(clients.stats)
+
+        client = self.blog.backend.client
+        self.assertIs(Blog.objects.get(pk=self.blog.pk).backend.client, client)
+        self.assertEqual(clients.stats['misses'] - stats['misses'], 1)
+        self.assertEqual(clients.stats['created'] - stats['created'], 1)
+        self.assertEqual(clients.stats['hits'] - stats['hits'], 1)
+
+        # A new access token replaces the account's client
+        social_auth = UserSocialAuth.objects.get(uid='1234')
+        social_auth.extra_data = {'access_token': 'new_token'}
+        social_auth.save()
+
+        self.assertIsNot(Blog.objects.get(pk=self.blog.pk).backend.client, client)
+        self.assertEqual(clients.stats['created'] - stats['created'], 2)
+        self.assertEqual(clients.stats['invalidations'] - stats['invalidations'], 1)
+
+        # Dropping clients counts each one removed
+        clients.invalidate('1234')
+        clients.invalidate('1234')
+        self.assertEqual(clients.stats['invalidations'] - stats['invalidations'], 2)
+
+        self.blog.backend.get_dropbox_client()
+        clients.invalidate()
+        self.assertEqual(clients.stats['invalidations'] - stats['invalidations'], 3)
+        self.assertEqual(clients.stats['created'] - stats['created'], 3)
+
     @patch.object(Dropbox, 'files_download')
     def test_get_file(self, mock_get_file):
         expected = 'title: Hello world\n\n\nHello world'
@@ -134,20 +180,9 @@ class DropboxBackendTestCase(TestCase):
             datetime.datetime(2016, 4, 1, 12, 0, tzinfo=timezone.utc)
         )
 
-    @patch.object(Dropbox, 'files_get_metadata')
-    def test_get_source_list(self, mock_metadata):
-        mock_metadata.return_value = {
-            'modified': 'Wed, 20 Jul 2011 22:04:50 +0000',
-            'hash': 'efdac89c4da886a9cece1927e6c22977',
-            'contents': [
-                {
-                    'path': '/foo'
-                },
-                {
-                    'path': '/bar'
-                }
-            ]
-        }
+    @patch.object(Dropbox, 'files_list_folder')
+    def test_get_source_list(self, mock_list_folder):
+        mock_list_folder.return_value = list_folder_result(['/foo', '/bar'], 'cursor')
 
         expected = (
             (0, '---'),
@@ -157,6 +192,116 @@ class DropboxBackendTestCase(TestCase):
 
         source_list = self.blog.backend.get_source_list()
         self.assertEqual(expected, source_list)
+        mock_list_folder.assert_called_once_with('')
+
+    @patch.object(Dropbox, 'files_list_folder')
+    def test_listing_cache(self, mock_list_folder):
+        mock_list_folder.return_value = list_folder_result(['/foo'], 'cursor')
+
+        self.assertEqual(self.blog.backend.get_cached_paths(), ['/foo'])
+        self.assertEqual(self.blog.backend.get_cached_paths(), ['/foo'])
+        self.assertEqual(mock_list_folder.call_count, 1)
+
+        # Listings are cached per account
+        user = User.objects.create(username='other')
+        UserSocialAuth.objects.create(
+            provider='dropbox-oauth2', uid='5678', user=user,
+            extra_data={'access_token': 'token'})
+        blog = Blog.objects.create(
+            name='Other',
+            backend_class='stardate.backends.dropbox.DropboxBackend',
+            backend_file='/other.md',
+            user=user,
+        )
+        mock_list_folder.return_value = list_folder_result(['/bar'], 'cursor')
+
+        self.assertEqual(blog.backend.get_cached_paths(), ['/bar'])
+        self.assertEqual(self.blog.backend.get_cached_paths(), ['/foo'])
+
+    @patch('stardate.backends.dropbox.LISTING_MAX_BYTES', 8)
+    @patch.object(Dropbox, 'files_list_folder')
+    def test_listing_cache_size(self, mock_list_folder):
+        mock_list_folder.return_value = list_folder_result(['/foo', '/bar', '/baz'], 'cursor')
+
+        # A cold listing matches the cached one
+        with patch('stardate.backends.dropbox.logger') as logger:
+            self.assertEqual(self.blog.backend.get_cached_paths(), ['/foo', '/bar'])
+        self.assertTrue(logger.warning.called)
+        self.assertEqual(self.blog.backend.get_cached_paths(), ['/foo', '/bar'])
+
+        # Pulls still see every file
+        self.assertEqual(self.blog.backend._list_path('/'), ['/foo', '/bar', '/baz'])
+
+    @patch('stardate.backends.dropbox.threading.Thread')
+    @patch.object(Dropbox, 'files_list_folder')
+    def test_stale_listing_is_refreshed(self, mock_list_folder, mock_thread):
+        from stardate.backends.dropbox import LISTING_TTL
+
+        backend = self.blog.backend
+        mock_list_folder.return_value = list_folder_result(['/foo'], 'cursor')
+        backend.get_cached_paths()
+
+        stale = time.time() + LISTING_TTL + 1
+        with patch('stardate.backends.dropbox.time.time', return_value=stale):
+            self.assertEqual(backend.get_cached_paths(), ['/foo'])
+            self.assertEqual(backend.get_cached_paths(), ['/foo'])
+
+        # The stale listing is served while a single refresh runs
+        self.assertEqual(mock_list_folder.call_count, 1)
+        self.assertEqual(mock_thread.call_count, 1)
+
+        mock_list_folder.return_value = list_folder_result(['/foo', '/bar'], 'cursor')
+        kwargs = mock_thread.call_args[1]
+        kwargs['target'](*kwargs['args'])
+
+        self.assertEqual(backend.get_cached_paths(), ['/foo', '/bar'])
+
+    @patch.object(Dropbox, 'files_download')
+    @patch.object(Dropbox, 'files_list_folder_continue')
+    @patch.object(Dropbox, 'files_list_folder')
+    @patch.object(Dropbox, 'files_get_metadata')
+    def test_pull_folder_with_cursor(self, mock_metadata, mock_list_folder,
+                                     mock_list_continue, mock_get_file):
+        files = {
+            '/posts/foo.md': 'title: Foo\n\n\nFoo.',
+            '/posts/bar.md': 'title: Bar\n\n\nBar.',
+        }
+
+        def get_file(path):
+            mock_file = Mock()
+            mock_file.content = files[path]
+            return ('meta', mock_file)
+
+        self.blog.backend_file = '/posts'
+        self.blog.save()
+
+        mock_metadata.return_value = Mock(spec=FolderMetadata)
+        mock_get_file.side_effect = get_file
+
+        # The first pull pages through the whole folder
+        mock_list_folder.return_value = list_folder_result(
+            ['/posts/foo.md'], 'cursor-1', has_more=True)
+        mock_list_continue.return_value = list_folder_result(
+            ['/posts/bar.md'], 'cursor-2')
+
+        pulled_posts = self.blog.backend.pull(write_back=False)
+
+        self.assertEqual([p.title for p in pulled_posts.posts()], ['Foo', 'Bar'])
+        self.assertEqual(self.blog.backend.get_cursor('/posts'), 'cursor-2')
+
+        # Later pulls only fetch what changed since the cursor
+        files['/posts/bar.md'] = 'stardate: {0}\ntitle: Bar\n\n\nA new bar.'.format(
+            pulled_posts[1])
+        mock_list_continue.return_value = list_folder_result(
+            ['/posts/bar.md'], 'cursor-3')
+        mock_get_file.reset_mock()
+
+        pulled_posts = self.blog.backend.pull(write_back=False)
+
+        mock_list_continue.assert_called_with('cursor-2')
+        mock_get_file.assert_called_once_with('/posts/bar.md')
+        self.assertEqual([p.body.raw for p in pulled_posts.posts()], ['A new bar.\n'])
+        self.assertEqual(self.blog.backend.get_cursor('/posts'), 'cursor-3')
 
     @patch.object(Dropbox, 'files_upload')
     @patch.object(Dropbox, 'files_download')
@@ -175,12 +320,90 @@ class DropboxBackendTestCase(TestCase):
 
         pulled_posts = self.blog.backend.pull()
         self.assertEqual(len(pulled_posts), 2)
-        self.assertEqual(pulled_posts[0].title, 'Test post title')
-        self.assertEqual(pulled_posts[1].title, 'Bar')
+        posts = list(pulled_posts.posts())
+        self.assertEqual(posts[0].title, 'Test post title')
+        self.assertEqual(posts[1].title, 'Bar')
 
         # There should be no posts returned after the first update
         self.assertEqual(self.blog.backend.pull(), [])
 
+    @patch.object(Dropbox, 'files_upload')
+    @patch.object(Dropbox, 'files_download')
+    @patch.object(Dropbox, 'files_get_metadata')
+    def test_pull_snapshot_by_rev(self, mock_metadata, mock_get_file, mock_put_file):
+        snapshot_dir = tempfile.mkdtemp()
+        with open(self.blog.backend_file, 'w') as backend_file:
+            backend_file.write('stardate: foo\ntimezone: UTC\ntitle: Foo\n\n\nHello world.\n')
+
+        mock_get_file.side_effect = mock_get
+        mock_put_file.side_effect = mock_put
+        mock_metadata.return_value = Mock(
+            spec=FileMetadata, rev='rev-1', path_lower=self.blog.backend_file.lower(),
+            server_modified=parse('Wed, 20 Jul 2011 22:04:50 +0000'))
+
+        with patch('stardate.backends.SNAPSHOT_DIR', snapshot_dir):
+            self.assertEqual(len(self.blog.backend.pull()), 1)
+            self.assertEqual(len(self.blog.backend.pull(force=True)), 0)
+
+        # The file was downloaded once, and its revision came with last_sync
+        self.assertEqual(mock_get_file.call_count, 1)
+        self.assertEqual(mock_metadata.call_count, 2)
+
+        for f in os.listdir(snapshot_dir):
+            os.remove(os.path.join(snapshot_dir, f))
+        os.removedirs(snapshot_dir)
+
+    @patch.object(Dropbox, 'files_upload')
+    @patch.object(Dropbox, 'files_download')
+    @patch.object(Dropbox, 'files_get_metadata')
+    def test_pull_reads_metadata_once(self, mock_metadata, mock_get_file, mock_put_file):
+        with open(self.blog.backend_file, 'w') as backend_file:
+            backend_file.write('title: Foo\n\n\nHello world.')
+
+        uploaded = Mock(spec=FileMetadata, path_lower=self.blog.backend_file.lower(),
+                        server_modified=parse('Thu, 21 Jul 2011 22:04:50 +0000'))
+
+        def put_file(content, path, mode):
+            mock_put(content, path, mode)
+            return uploaded
+
+        mock_get_file.side_effect = mock_get
+        mock_put_file.side_effect = put_file
+        mock_metadata.return_value = MockMetadata()
+
+        self.assertIs(self.blog.backend, self.blog.backend)
+
+        pulled_posts = self.blog.backend.pull()
+
+        # The pulled post got a stardate, so it was written back once
+        self.assertEqual(len(pulled_posts.stale), 1)
+        self.assertEqual(mock_put_file.call_count, 1)
+        self.assertEqual(mock_metadata.call_count, 1)
+        self.assertEqual(self.blog.last_sync, uploaded.server_modified)
+
+    @patch.object(Dropbox, 'files_upload')
+    @patch.object(Dropbox, 'files_download')
+    @patch.object(Dropbox, 'files_list_folder')
+    @patch.object(Dropbox, 'files_get_metadata')
+    def test_pull_folder_reads_metadata_once(self, mock_metadata, mock_list_folder,
+                                             mock_get_file, mock_put_file):
+        mock_file = Mock()
+        mock_file.content = 'title: Foo\n\n\nFoo.'
+        mock_get_file.return_value = ('meta', mock_file)
+        mock_metadata.return_value = Mock(spec=FolderMetadata)
+        mock_list_folder.return_value = list_folder_result(['/posts/foo.md'], 'cursor')
+
+        self.blog.backend_file = '/posts'
+        self.blog.save()
+
+        pulled_posts = self.blog.backend.pull()
+
+        # The pulled post got a stardate and was written back, without
+        # another metadata call for the folder
+        self.assertEqual(len(pulled_posts.stale), 1)
+        self.assertEqual(mock_put_file.call_count, 1)
+        self.assertEqual(mock_metadata.call_count, 1)
+
     @patch.object(Dropbox, 'files_upload')
     @patch.object(Dropbox, 'files_download')
     @patch.object(Dropbox, 'files_get_metadata')
@@ -331,6 +554,221 @@ class LocalFileBackendTestCase(TestCase):
             os.remove(f)
         os.removedirs(temp_dir)
 
+    def test_posts_from_dir_concurrently(self):
+        temp_dir = tempfile.mkdtemp()
+        for i in range(10):
+            with open(os.path.join(temp_dir, 'post-{0}.md'.format(i)), 'w') as f:
+                f.write('title: Post {0}\n\n\nBody {0}.'.format(i))
+
+        self.blog.backend_file = temp_dir
+        backend = self.blog.backend
+        paths = sorted(os.listdir(temp_dir))
+        get_file = backend.get_file
+
+        def flaky_get_file(path):
+            if path.endswith('post-3.md'):
+                raise IOError('Could not read file')
+            return get_file(path)
+
+        with patch.object(backend, '_list_path', return_value=[os.path.join(temp_dir, p) for p in paths]):
+            with patch.object(backend, 'get_file', side_effect=flaky_get_file):
+                with patch('stardate.backends.WORKERS', 4):
+                    posts = backend.get_posts()
+
+        self.assertEqual(
+            [p['title'] for p in posts],
+            ['Post {0}'.format(i) for i in range(10) if i != 3])
+
+        for f in os.listdir(temp_dir):
+            os.remove(os.path.join(temp_dir, f))
+        os.removedirs(temp_dir)
+
+    def test_get_posts_snapshot(self):
+        snapshot_dir = tempfile.mkdtemp()
+        with open(self.blog.backend_file, 'w') as f:
+            f.write('title: Snapshot\npublish: 2016-01-01 12:00 AM\ntimezone: US/Eastern\n\n\nBody.')
+
+        backend = self.blog.backend
+        parser = backend.parser
+
+        with patch('stardate.backends.SNAPSHOT_DIR', snapshot_dir):
+            posts = backend.get_posts()
+
+            with patch.object(parser, 'iter_unpack') as iter_unpack:
+                self.assertEqual(backend.get_posts(), posts)
+            self.assertFalse(iter_unpack.called)
+
+            # A new parser version discards the snapshot
+            with patch.object(FileParser, 'version', 2):
+                with patch.object(parser, 'iter_unpack', return_value=iter([])) as iter_unpack:
+                    self.assertEqual(backend.get_posts(), [])
+                self.assertTrue(iter_unpack.called)
+
+            # So does a change to the file
+            with open(self.blog.backend_file, 'a') as f:
+                f.write(' Changed.')
+            self.assertEqual(backend.get_posts()[0]['body'], 'Body. Changed.')
+
+        self.assertEqual(posts[0]['publish'], datetime.datetime(2016, 1, 1, 5, tzinfo=timezone.utc))
+        self.assertEqual(len(os.listdir(snapshot_dir)), 1)
+
+        for f in os.listdir(snapshot_dir):
+            os.remove(os.path.join(snapshot_dir, f))
+        os.removedirs(snapshot_dir)
+
+    @patch('stardate.backends.BATCH_SIZE', 2)
+    def test_snapshot_streams_chunks(self):
+        snapshot_dir = tempfile.mkdtemp()
+        path = os.path.join(snapshot_dir, 'blog.pickle')
+        posts = [{'title': 'Post {0}'.format(i)} for i in range(5)]
+
+        # Posts that aren't all read leave no snapshot
+        saving = save_snapshot(path, 'key', iter(posts))
+        next(saving)
+        saving.close()
+        self.assertEqual(os.listdir(snapshot_dir), [])
+
+        self.assertEqual(list(save_snapshot(path, 'key', iter(posts))), posts)
+
+        # The key, then a pickle per chunk of posts
+        with open(path, 'rb') as f:
+            self.assertEqual(pickle.load(f), 'key')
+            self.assertEqual([len(pickle.load(f)) for i in range(3)], [2, 2, 1])
+            self.assertRaises(EOFError, pickle.load, f)
+
+        self.assertEqual(list(load_snapshot(path, 'key')), posts)
+        self.assertIsNone(load_snapshot(path, 'other key'))
+
+        os.remove(path)
+        os.removedirs(snapshot_dir)
+
+    def test_pull_dir_manifest(self):
+        temp_dir = tempfile.mkdtemp()
+        for i in range(3):
+            with open(os.path.join(temp_dir, 'post-{0}.md'.format(i)), 'w') as f:
+                f.write('stardate: s{0}\ntitle: Post {0}\n\n\nBody {0}.'.format(i))
+
+        self.blog.backend_file = temp_dir
+        self.blog.save()
+        backend = self.blog.backend
+        get_file = backend.get_file
+
+        with patch.object(backend, 'push'):
+            self.assertEqual(len(backend.pull()), 3)
+
+            # Nothing changed, so nothing is read
+            with patch.object(backend, 'get_file', side_effect=get_file) as read:
+                self.assertEqual(backend.pull(), [])
+            self.assertFalse(read.called)
+
+            # Only the changed file is read, even within the same second
+            with open(os.path.join(temp_dir, 'post-1.md'), 'a') as f:
+                f.write(' Changed.')
+            os.remove(os.path.join(temp_dir, 'post-2.md'))
+
+            with patch.object(backend, 'get_file', side_effect=get_file) as read:
+                pulled = backend.pull()
+            read.assert_called_once_with(os.path.join(temp_dir, 'post-1.md'))
+
+        self.assertEqual([p.body.raw for p in pulled.posts()], ['Body 1. Changed.\n'])
+        self.assertEqual(
+            sorted(Post.objects.filter(blog=self.blog, deleted=True).values_list('title', flat=True)),
+            ['Post 2'])
+        self.assertEqual(
+            sorted(json.loads(Blog.objects.get(pk=self.blog.pk).sync_state)),
+            [os.path.join(temp_dir, 'post-{0}.md'.format(i)) for i in range(2)])
+
+        for f in os.listdir(temp_dir):
+            os.remove(os.path.join(temp_dir, f))
+        os.removedirs(temp_dir)
+
+    def test_pull_dir_manifest_moved_file(self):
+        temp_dir = tempfile.mkdtemp()
+        # File names that aren't the slugged titles
+        for name, stardate in (('foo.md', 's1'), ('notes.md', 's2')):
+            with open(os.path.join(temp_dir, name), 'w') as f:
+                f.write('stardate: {0}\ntitle: Foo {0}\n\n\nBody.'.format(stardate))
+
+        self.blog.backend_file = temp_dir
+        self.blog.save()
+        backend = self.blog.backend
+
+        with patch.object(backend, 'push'):
+            backend.pull()
+            manifest = json.loads(Blog.objects.get(pk=self.blog.pk).sync_state)
+            self.assertEqual(manifest[os.path.join(temp_dir, 'foo.md')][3], 's1')
+
+            os.rename(os.path.join(temp_dir, 'foo.md'), os.path.join(temp_dir, '2016-foo.md'))
+            os.remove(os.path.join(temp_dir, 'notes.md'))
+            backend.pull()
+
+        self.assertEqual(
+            dict(Post.objects.filter(stardate__in=['s1', 's2']).values_list('stardate', 'deleted')),
+            {'s1': False, 's2': True})
+
+        for f in os.listdir(temp_dir):
+            os.remove(os.path.join(temp_dir, f))
+        os.removedirs(temp_dir)
+
+    def test_posts_from_dir_in_processes(self):
+        temp_dir = tempfile.mkdtemp()
+        for i in range(10):
+            with open(os.path.join(temp_dir, 'post-{0}.md'.format(i)), 'w') as f:
+                f.write('title: Post {0}\npublish: 2016-01-01 12:00 AM\n\n\nBody {0}.'.format(i))
+        with open(os.path.join(temp_dir, 'bad.md'), 'w') as f:
+            f.write('title: [Not closed\n\n\nBad.')
+
+        self.blog.backend_file = temp_dir
+        backend = self.blog.backend
+        paths = [os.path.join(temp_dir, p) for p in sorted(os.listdir(temp_dir))]
+        expected = backend.get_posts(paths)
+
+        with patch('stardate.backends.PARSE_PROCESSES', 2):
+            with patch('stardate.backends.PARSE_PROCESS_THRESHOLD', 12):
+                with patch.object(backend, '_parse_in_processes') as in_processes:
+                    backend.get_posts(paths)
+                self.assertFalse(in_processes.called)
+
+            with patch('stardate.backends.PARSE_PROCESS_THRESHOLD', 5):
+                posts = backend.get_posts(paths)
+
+        self.assertEqual(len(posts), 10)
+        self.assertEqual(posts, expected)
+
+        # The pool is started once and reused
+        self.assertIs(get_parse_pool(2), get_parse_pool(2))
+
+        for f in os.listdir(temp_dir):
+            os.remove(os.path.join(temp_dir, f))
+        os.removedirs(temp_dir)
+
+    @patch('stardate.backends.PARSE_TIMEOUT', 2)
+    @patch.dict(os.environ, {'DJANGO_SETTINGS_MODULE': 'tests.missing_settings'})
+    def test_parse_pool_setup_fails(self):
+        # Workers that can't set up Django time out to parsing in-process
+        temp_dir = tempfile.mkdtemp()
+        path = os.path.join(temp_dir, 'post.md')
+        with open(path, 'w') as f:
+            f.write('title: Post\npublish: 2016-01-01 12:00 AM\n\n\nBody.')
+
+        with patch('stardate.backends.logger') as logger:
+            posts = self.blog.backend._parse_in_processes([path], 3)
+        self.assertTrue(logger.error.called)
+        self.assertEqual([post['title'] for post in posts], ['Post'])
+        self.assertNotIn(3, parse_pools)
+
+        os.remove(path)
+        os.removedirs(temp_dir)
+
+    @patch('stardate.backends.get_context', None)
+    def test_parse_pool_off_main_thread(self):
+        # Without spawn, workers are never forked from other threads
+        pools = []
+        thread = threading.Thread(target=lambda: pools.append(get_parse_pool(2)))
+        thread.start()
+        thread.join()
+        self.assertEqual(pools, [None])
+
     def test_pull(self):
         timestamp = '2013-01-01 6:00 AM'
         expected_timestamp = datetime.datetime(2013, 1, 1, 11, 0, tzinfo=timezone.utc)
@@ -339,13 +777,109 @@ class LocalFileBackendTestCase(TestCase):
         f.write('title: Post title\npublish: {0}\ntimezone: US/Eastern\n\n\nA post for pulling in.'.format(timestamp))
         f.close()
 
-        pulled_posts = self.blog.backend.pull()
+        pulled_posts = list(self.blog.backend.pull().posts())
 
         self.assertIsNotNone(pulled_posts[0].stardate)
         self.assertEqual(pulled_posts[0].title, 'Post title')
         self.assertEqual(pulled_posts[0].body.raw, 'A post for pulling in.\n')
         self.assertEqual(pulled_posts[0].publish, expected_timestamp)
 
+    def test_pull_counts(self):
+        post = self.post_list[0]
+        content = open(self.blog.backend_file).read()
+        content = content.replace('A very fine world it is.', 'A changed world.')
+        content += '\n---\n\ntitle: A new post\n\n\nNew body.'
+
+        with open(self.blog.backend_file, 'w') as f:
+            f.write(content)
+
+        pulled_posts = self.blog.backend.pull(force=True)
+
+        self.assertEqual(pulled_posts.created, 1)
+        self.assertEqual(pulled_posts.updated, 1)
+        self.assertEqual(pulled_posts.unchanged, 0)
+        self.assertEqual([p.title for p in pulled_posts.posts()], ['Hello world', 'A new post'])
+        self.assertTrue(all(p.pk for p in pulled_posts.posts()))
+        self.assertEqual(Post.objects.get(pk=post.pk).body.raw, 'A changed world.\n')
+        self.assertEqual(self.blog.posts.count(), 2)
+
+        pulled_posts = self.blog.backend.pull(force=True)
+
+        self.assertEqual(list(pulled_posts), [])
+        self.assertEqual(pulled_posts.unchanged, 2)
+
+    def test_pull_links_neighbours(self):
+        posts = ['title: Post {0}\npublish: 2016-01-0{0} 12:00 AM\n\n\nBody {0}.'.format(i)
+                 for i in range(1, 4)]
+
+        with open(self.blog.backend_file, 'w') as f:
+            f.write('\n---\n\n'.join(posts))
+
+        self.blog.backend.pull(force=True)
+
+        first, second, third = self.blog.posts.published().order_by('publish')
+        self.assertEqual(first.prev_post, None)
+        self.assertEqual(first.next_post, second)
+        self.assertEqual(second.prev_post, first)
+        self.assertEqual(second.next_post, third)
+        self.assertEqual(third.next_post, None)
+
+    def test_pull_writes_back_once(self):
+        posts = ['title: Post {0}\n\n\nBody {0}.'.format(i) for i in range(5)]
+
+        with open(self.blog.backend_file, 'w') as f:
+            f.write('\n---\n\n'.join(posts))
+
+        backend = self.blog.backend
+
+        with patch.object(backend, 'write_file', wraps=backend.write_file) as write_file:
+            backend.pull(force=True)
+            self.assertEqual(write_file.call_count, 1)
+
+            # The file now has stardates so there is nothing to write back
+            pulled_posts = backend.pull(force=True)
+            self.assertEqual(pulled_posts.stale, [])
+            self.assertEqual(write_file.call_count, 1)
+
+        self.assertEqual(open(self.blog.backend_file).read().count('stardate:'), 5)
+
+    def test_pull_without_write_back(self):
+        with open(self.blog.backend_file, 'w') as f:
+            f.write('title: Post title\n\n\nA post for pulling in.')
+
+        backend = self.blog.backend
+
+        with patch.object(backend, 'write_file') as write_file:
+            pulled_posts = backend.pull(force=True, write_back=False)
+
+        self.assertEqual(len(pulled_posts.stale), 1)
+        self.assertFalse(write_file.called)
+
+    def test_pull_batches_queries(self):
+        posts = ['title: Post {0}\n\n\nBody {0}.'.format(i) for i in range(20)]
+
+        with open(self.blog.backend_file, 'w') as f:
+            f.write('\n---\n\n'.join(posts))
+
+        backend = self.blog.backend
+
+        with patch.object(backend, 'push') as push, patch.object(Post.objects, 'link_neighbours'):
+            with patch('stardate.backends.BATCH_SIZE', 10):
+                with patch('stardate.backends.batch_save', wraps=batch_save) as save:
+                    # Existing slugs, an insert and an id select per chunk
+                    # inside a savepoint, the stale posts loaded a chunk at
+                    # a time, then the blog's own update
+                    with self.assertNumQueries(12):
+                        pulled_posts = backend.pull(force=True)
+
+        # Each chunk is written before the next is read, and written back
+        # a chunk at a time
+        self.assertEqual([len(call[0][0]) for call in save.call_args_list], [10, 10])
+        self.assertEqual([len(call[0][0]) for call in push.call_args_list], [10, 10])
+        self.assertEqual(pulled_posts.created, 20)
+        self.assertEqual(len(pulled_posts), 20)
+        self.assertEqual([p.title for p in pulled_posts.posts()], ['Post {0}'.format(i) for i in range(20)])
+
     def test_push(self):
         Post.objects.create(
             title='A test push post',
@@ -375,6 +909,104 @@ class LocalFileBackendTestCase(TestCase):
         self.assertTrue('publish: 2016-02-01 12:00 AM +0000' in content)
         self.assertTrue('\n\nfoo.\n' in content)
 
+    def test_push_merges_in_place(self):
+        post = self.post_list[0]
+
+        with open(self.blog.backend_file, 'w') as f:
+            f.write(
+                'title: Remote only\n\n\nNot pulled yet.\n---\n\n' +
+                'title: Created remotely\n\n\nOld body.\n---\n\n' +
+                'stardate: {0}\ntitle: Old title\n\n\nOld body.\n'.format(post.stardate)
+            )
+
+        post.title = 'Hello again'
+        pulled = Post(blog=self.blog, title='Created remotely', body='New body.')
+        pulled.clean()
+        new = Post(blog=self.blog, title='Brand new', body='Brand new body.')
+        new.clean()
+
+        self.blog.backend.push([post, pulled, new])
+
+        posts = self.blog.backend.get_posts()
+        self.assertEqual(
+            [p['title'] for p in posts],
+            ['Remote only', 'Created remotely', 'Hello again', 'Brand new'])
+        self.assertEqual(posts[1]['stardate'], pulled.stardate)
+        self.assertEqual(posts[1]['body'], 'New body.\n')
+        self.assertEqual(posts[2]['stardate'], post.stardate)
+
+    def test_push_splices_changed_posts(self):
+        post = self.post_list[0]
+        untouched = (
+            'title:   Hand written\nnote: kept as is\n\n\nUntouched body.\n---\n\n' +
+            'not a post\n---\n\n'
+        )
+
+        with open(self.blog.backend_file, 'w') as f:
+            f.write(untouched + 'stardate: {0}\ntitle: Old title\n\n\nOld body.\n'.format(
+                post.stardate))
+
+        new = Post(blog=self.blog, title='Brand new', body='Brand new body.')
+        new.clean()
+
+        with patch.object(FileParser, 'render', wraps=self.blog.backend.parser.render) as render:
+            self.blog.backend.push([post, new])
+
+        # Only the changed post, before and after, and the new post
+        self.assertEqual(render.call_count, 3)
+
+        with open(self.blog.backend_file) as f:
+            content = f.read()
+
+        self.assertTrue(content.startswith(untouched))
+        self.assertEqual(
+            content[len(untouched):].split('\n---\n\n'),
+            [FileParser().render(post.serialized()), FileParser().render(new.serialized())])
+
+        # Nothing is written when every post is up to date
+        with patch.object(self.blog.backend, 'write_file') as write_file:
+            self.assertEqual(self.blog.backend.push([post, new]), [None])
+        self.assertFalse(write_file.called)
+
+    def test_push_post_files(self):
+        temp_dir = tempfile.mkdtemp()
+        self.blog.backend_file = temp_dir
+        backend = self.blog.backend
+
+        posts = [Post(blog=self.blog, title='Post {0}'.format(i), body='Body.')
+                 for i in range(6)]
+        for post in posts:
+            post.clean()
+
+        write_file = backend.write_file
+
+        def flaky_write_file(path, content):
+            if path.endswith('post-2.md'):
+                raise IOError('Could not write file')
+            write_file(path, content)
+            return path
+
+        with patch.object(backend, 'write_file', side_effect=flaky_write_file):
+            with patch('stardate.backends.WORKERS', 3):
+                with self.assertRaises(PushError) as cm:
+                    backend.push(posts)
+
+        # Every other post is still written
+        responses = cm.exception.responses
+        self.assertEqual(len(responses), 6)
+        self.assertEqual(
+            [path for path, err in cm.exception.errors],
+            [os.path.join(temp_dir, 'post-2.md')])
+        self.assertIsInstance(responses[2], IOError)
+        self.assertEqual(
+            [r for i, r in enumerate(responses) if i != 2],
+            [os.path.join(temp_dir, 'post-{0}.md'.format(i)) for i in range(6) if i != 2])
+        self.assertEqual(len(os.listdir(temp_dir)), 5)
+
+        for f in os.listdir(temp_dir):
+            os.remove(os.path.join(temp_dir, f))
+        os.removedirs(temp_dir)
+
     def test_disabled_blog(self):
         self.blog.sync = False
         self.blog.save()
@@ -3,6 +3,7 @@ import tempfile
 
 from django.core.exceptions import ValidationError
 from django.contrib.auth.models import User
+from django.db import connection
 from django.test import TestCase
 from django.utils import timezone
 
@@ -12,6 +13,7 @@ except ImportError:
     from django.test import override_settings
 
 from dateutil import tz
+from mock import patch
 
 from stardate.models import Blog, Post
 from stardate.utils import get_post_model
@@ -89,6 +91,17 @@ class BlogTestCase(TestCase):
         self.assertTrue(timezone.is_aware(post.publish))
         self.assertEqual(post.publish, expected)
 
+    def test_post_backend_is_lazy(self):
+        with patch('stardate.backends.get_backend') as get_backend:
+            with self.assertNumQueries(1):
+                posts = list(Post.objects.all())
+
+            self.assertEqual(len(posts), 2)
+            self.assertFalse(get_backend.called)
+
+            posts[0].backend
+            self.assertEqual(get_backend.call_count, 1)
+
     def test_get_posts(self):
         post_list = self.blog.posts.all()
         self.assertTrue(len(post_list), 2)
@@ -111,9 +124,161 @@ class BlogTestCase(TestCase):
         self.assertEqual(last_post.get_prev_post(), first_post)
         self.assertFalse(first_post.get_prev_post())
 
+    def test_neighbours_follow_publish_order(self):
+        first_post = Post.objects.get(title="Test post 1 title")
+        last_post = Post.objects.get(title="Test post 2 title")
+
+        middle_post = Post.objects.create(
+            blog=self.blog,
+            title="Test post 3 title",
+            publish=datetime.datetime(2012, 1, 2, 20, 0, tzinfo=timezone.utc)
+        )
+        first_post.refresh_from_db()
+        self.assertEqual(first_post.get_next_post(), middle_post)
+        self.assertEqual(middle_post.get_prev_post(), first_post)
+        self.assertEqual(middle_post.get_next_post(), last_post)
+
+        # Unpublishing takes a post out of the chain
+        middle_post.publish = None
+        middle_post.save()
+        first_post.refresh_from_db()
+        self.assertEqual(first_post.get_next_post(), last_post)
+        self.assertFalse(middle_post.get_next_post())
+
+        # So does marking it as deleted
+        middle_post.publish = datetime.datetime(2012, 1, 2, 20, 0, tzinfo=timezone.utc)
+        middle_post.mark_deleted().save()
+        first_post.refresh_from_db()
+        self.assertEqual(first_post.get_next_post(), last_post)
+
+        last_post.delete()
+        first_post.refresh_from_db()
+        self.assertFalse(first_post.get_next_post())
+
+    def test_neighbours_after_queryset_delete(self):
+        first_post = Post.objects.get(title="Test post 1 title")
+        last_post = Post.objects.get(title="Test post 2 title")
+        middle_post = Post.objects.create(
+            blog=self.blog,
+            title="Test post 3 title",
+            publish=datetime.datetime(2012, 1, 2, 20, 0, tzinfo=timezone.utc)
+        )
+
+        # As the admin's delete action does
+        Post.objects.filter(pk=middle_post.pk).delete()
+        first_post.refresh_from_db()
+        self.assertEqual(first_post.get_next_post(), last_post)
+
+    def test_save_relinks_only_on_chain_changes(self):
+        post = Post.objects.get(title="Test post 1 title")
+
+        with patch.object(Post.objects, 'link_neighbours', return_value=0) as link:
+            post.title = "Retitled"
+            post.save()
+            self.assertFalse(link.called)
+
+            post.publish = datetime.datetime(2012, 1, 5, tzinfo=timezone.utc)
+            post.save()
+            self.assertEqual(link.call_count, 1)
+
+            post.mark_deleted().save()
+            self.assertEqual(link.call_count, 2)
+
+    def test_neighbours_skip_scheduled_posts(self):
+        last_post = Post.objects.get(title="Test post 2 title")
+        Post.objects.create(
+            blog=self.blog,
+            title="A scheduled post",
+            publish=timezone.now() + datetime.timedelta(days=1)
+        )
+        last_post.refresh_from_db()
+        self.assertTrue(last_post.next_post)
+        self.assertFalse(last_post.get_next_post())
+
+    def test_neighbours_without_queries(self):
+        first_post = Post.objects.get(title="Test post 1 title")
+        post = self.blog.posts.select_related('prev_post', 'next_post').get(
+            title="Test post 2 title")
+
+        with self.assertNumQueries(0):
+            self.assertEqual(post.get_prev_post(), first_post)
+            self.assertFalse(post.get_next_post())
+            post.get_prev_post().get_absolute_url()
+
     def test_save_invalid_post(self):
         data = {
             'blog': self.blog
         }
         p = Post(**data)
         self.assertRaises(ValidationError, p.save)
+
+    def test_published_list(self):
+        Post.objects.create(
+            blog=self.blog, title='Listed', body='Listed body.',
+            publish=datetime.datetime(2016, 1, 1, tzinfo=timezone.utc))
+
+        with self.assertNumQueries(1):
+            posts = list(Post.objects.published_list())
+            urls = [post.get_absolute_url() for post in posts]
+
+        self.assertIn('/{0}/listed/'.format(self.blog.slug), urls)
+        self.assertEqual(
+            posts[0].get_deferred_fields(), set(['body', '_body_rendered']))
+        self.assertEqual(
+            Post.objects.published_list(rendered=True)[0].get_deferred_fields(),
+            set(['body']))
+
+
+class PostQueryPlanTestCase(TestCase):
+    """
+    Checks that the hot Post queries are served by an index on SQLite.
+    """
+    def setUp(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('Query plans are only checked on SQLite')
+
+        user = User.objects.create(username='bturner')
+        self.blog = Blog.objects.create(
+            name='Query plans',
+            backend_class='stardate.backends.local_file.LocalFileBackend',
+            backend_file=tempfile.mkstemp(suffix='.txt', text=True)[1],
+            user=user,
+        )
+
+    def assertUsesIndex(self, queryset, columns, ordered=False):
+        """
+        Assert the query searches an index on all ``columns``, and that
+        ordered queries don't need a temporary sort.
+        """
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            plan = [row[-1] for row in cursor.fetchall()]
+
+        table = queryset.model._meta.db_table
+        searches = [detail for detail in plan
+                    if detail.startswith('SEARCH') and table in detail]
+
+        self.assertTrue(searches, 'Table scan on {0}: {1}'.format(table, plan))
+        for column in columns:
+            self.assertIn('{0}='.format(column), searches[0].replace(' ', ''))
+        if ordered:
+            self.assertFalse(
+                [detail for detail in plan if 'TEMP B-TREE' in detail], plan)
+
+    def test_published(self):
+        columns = ['blog_id', 'deleted']
+        self.assertUsesIndex(self.blog.posts.published(), columns, ordered=True)
+        self.assertUsesIndex(
+            Post.objects.published().filter(blog=self.blog), columns, ordered=True)
+
+    def test_stardate_lookup(self):
+        queryset = Post.objects.filter(blog=self.blog, stardate='abc').order_by()
+        self.assertUsesIndex(queryset, ['blog_id', 'stardate'])
+
+    def test_custom_post_model(self):
+        queryset = CustomPost.objects.published().filter(blog=self.blog)
+        self.assertUsesIndex(queryset, ['blog_id', 'deleted'], ordered=True)
+
+        queryset = CustomPost.objects.filter(blog=self.blog, stardate='abc').order_by()
+        self.assertUsesIndex(queryset, ['blog_id', 'stardate'])
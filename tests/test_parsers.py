@@ -1,9 +1,13 @@
 import datetime
+import io
 import pytz
 import tempfile
+import time
 import uuid
+import yaml
 
 from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.test import TestCase
 from django.utils import timezone
 
@@ -12,7 +16,9 @@ from dateutil.parser import parse
 from mock import patch
 
 from stardate.models import Blog, Post
-from stardate.parsers import FileParser
+from stardate.parsers import (
+    FileParser, ParseCache, YAMLLoader, load_front_matter, parse_datetime
+)
 
 
 TIMESTAMP = '2012-01-02 12:00 AM'
@@ -118,6 +124,38 @@ class FileParserTestCase(TestCase):
             datetime.datetime(2016, 1, 1, tzinfo=tz.gettz('US/Eastern'))
         )
 
+    def test_parse_datetime(self):
+        strings = [
+            '2012-01-02 09:00 AM',
+            '2012-01-02 12:00 AM',
+            '2012-01-02 12:30 PM',
+            '2012-01-02 11:59 PM',
+            '2012-01-02 09:00 AM +0000',
+            '2012-01-02 09:00 AM -0000',
+            '2012-01-02 09:00 PM -0500',
+            '2012-07-02 09:00 PM +0530',
+            '2012-01-02 09:00 am',
+            '2012-01-02 9:00 AM',
+            '2016-01-01 00:00:00 -0500',
+        ]
+        for string in strings:
+            expected = parse(string)
+            parsed = parse_datetime(string)
+            self.assertEqual(parsed, expected)
+            self.assertEqual(type(parsed.tzinfo), type(expected.tzinfo))
+            self.assertEqual(parsed.utcoffset(), expected.utcoffset())
+
+        with self.assertRaises(ValueError):
+            parse_datetime('2012-02-30 09:00 AM')
+
+    @patch('stardate.parsers.parse')
+    def test_parse_datetime_skips_dateutil(self, mock_parse):
+        self.assertEqual(
+            parse_datetime('2012-01-02 09:00 PM -0500'),
+            datetime.datetime(2012, 1, 2, 21, tzinfo=tz.tzoffset(None, -18000))
+        )
+        self.assertFalse(mock_parse.called)
+
     def test_parse(self):
         parsed = self.parser.parse(self.test_string)
 
@@ -133,6 +171,33 @@ class FileParserTestCase(TestCase):
         self.assertTrue('title' in parsed.keys())
         self.assertTrue('extra_field' in parsed.keys())
 
+    def test_load_front_matter(self):
+        blocks = [
+            'title: Tingling of the spine\ntimezone: US/Eastern',
+            'publish: 2012-01-02 12:00 AM\nstardate: 1d7e8c2a-a6a4-11e5-9c4b-7831c1d1a7b8',
+            'title: Trailing spaces   \n\nextra_field: Something arbitrary',
+            'publish: 2016-01-01',
+            'publish: 2016-01-01 00:00:00',
+            'title: 1984\ndraft: yes\nrating: 4.5\nempty: ~',
+            'title: Null',
+            'title: "Quoted: title"',
+            'title: A title # with a comment',
+            'tags:\n  - one\n  - two',
+            'title: Two\n  lines',
+            'title:',
+        ]
+
+        for block in blocks:
+            self.assertEqual(
+                load_front_matter(block), yaml.load(block, Loader=YAMLLoader), block)
+
+    @patch('stardate.parsers.yaml.load')
+    def test_flat_front_matter_skips_yaml(self, mock_load):
+        parsed = self.parser.parse(self.test_string)
+
+        self.assertEqual(parsed['title'], 'Tingling of the spine')
+        self.assertFalse(mock_load.called)
+
     def test_render(self):
         file_path = tempfile.mkstemp(suffix='.txt')[1]
         user = User.objects.create(username='bturner')
@@ -181,6 +246,144 @@ class FileParserTestCase(TestCase):
 
         self.assertEqual(post.get('body'), 'Extraordinary claims require extraordinary evidence!')
 
+    def test_iter_unpack(self):
+        content = u'\n---\n\n'.join(
+            u'title: Caf\xe9 {0}\n\n\nBody of post {0} \u2603'.format(i)
+            for i in range(5))
+        expected = self.parser.unpack(content)
+        encoded = content.encode('utf-8')
+
+        # Chunk boundaries fall inside delimiters and multi-byte characters
+        for size in (1, 2, 3, 7, 64):
+            chunks = [encoded[i:i + size] for i in range(0, len(encoded), size)]
+            self.assertEqual(list(self.parser.iter_unpack(chunks)), expected)
+
+        self.assertEqual(list(self.parser.iter_unpack(io.StringIO(content))), expected)
+
+        self.assertEqual(len(expected), 5)
+
+    def test_iter_spans(self):
+        content = 'title: One\n\n\nOne.\n---\n\nbad\n---\n\ntitle: Two\n\n\nTwo.'
+        chunks = [content[i:i + 4] for i in range(0, len(content), 4)]
+        spans = list(self.parser.iter_spans(chunks))
+
+        self.assertEqual(
+            [content[start:end] for start, end, post in spans],
+            content.split(self.parser.delimiter))
+        self.assertEqual(
+            [post and post['title'] for start, end, post in spans],
+            ['One', None, 'Two'])
+
+    def test_parse_cache(self):
+        parser = FileParser(cache=ParseCache(size=3))
+        posts = ['title: Post {0}\n\n\nBody {0}.'.format(i) for i in range(3)]
+        content = parser.delimiter.join(posts)
+
+        expected = parser.unpack(content)
+        self.assertEqual(parser.cache.stats, {'hits': 0, 'misses': 3})
+
+        # Only the changed post is parsed again
+        posts[2] = 'title: Post 2\n\n\nChanged.'
+        with patch.object(parser, 'parse', wraps=parser.parse) as parse:
+            unpacked = parser.unpack(parser.delimiter.join(posts))
+        self.assertEqual(parse.call_count, 1)
+        self.assertEqual(unpacked[:2], expected[:2])
+        self.assertEqual(unpacked[2]['body'], 'Changed.')
+        self.assertEqual(parser.cache.stats, {'hits': 2, 'misses': 4})
+
+        # The least recently used post was dropped
+        self.assertEqual(len(parser.cache.posts), 3)
+        self.assertIsNone(parser.cache.get(
+            parser.cache.key(content.split(parser.delimiter)[2], parser.version)))
+
+        # Cached dictionaries aren't shared with callers
+        unpacked[1]['title'] = 'Changed'
+        self.assertEqual(parser.unpack(content)[1]['title'], 'Post 1')
+
+    def test_parse_cache_larger_file(self):
+        parser = FileParser(cache=ParseCache(size=3))
+        content = parser.delimiter.join(
+            'title: Post {0}\n\n\nBody {0}.'.format(i) for i in range(5))
+
+        expected = parser.unpack(content)
+        self.assertEqual(len(parser.cache.posts), 3)
+
+        # The head of the file stays cached rather than being evicted by
+        # the tail, which is parsed without the cache
+        with patch.object(parser, 'parse', wraps=parser.parse) as parse:
+            self.assertEqual(parser.unpack(content), expected)
+        self.assertEqual(parse.call_count, 2)
+        self.assertEqual(parser.cache.stats, {'hits': 3, 'misses': 3})
+
+    def test_persistent_parse_cache(self):
+        cache.clear()
+        string = 'title: Persisted\n\n\nBody.'
+
+        FileParser(cache=ParseCache(alias='default')).unpack(string)
+
+        parser = FileParser(cache=ParseCache(alias='default'))
+        with patch.object(parser, 'parse') as parse:
+            self.assertEqual(parser.unpack(string)[0]['title'], 'Persisted')
+        self.assertFalse(parse.called)
+        self.assertEqual(parser.cache.stats['hits'], 1)
+
+        # A new parser version parses again
+        parser = FileParser(cache=ParseCache(alias='default'))
+        with patch.object(FileParser, 'version', 2):
+            with patch.object(parser, 'parse', wraps=parser.parse) as parse:
+                parser.unpack(string)
+        self.assertTrue(parse.called)
+
+        # Entries expire
+        with patch('django.core.cache.backends.locmem.LocMemCache.set_many') as cache_set:
+            FileParser(cache=ParseCache(alias='default', timeout=60)).unpack('title: New\n\n\nBody.')
+        self.assertEqual(cache_set.call_args[0][1], 60)
+
+    def test_persistent_parse_cache_batches(self):
+        cache.clear()
+        content = self.parser.delimiter.join(
+            'title: Post {0}\n\n\nBody {0}.'.format(i) for i in range(250))
+
+        # One read and one write of the Django cache per hundred segments,
+        # and for the segment after the last delimiter
+        parser = FileParser(cache=ParseCache(alias='default'))
+        with patch.object(cache, 'get_many', wraps=cache.get_many) as get_many:
+            with patch.object(cache, 'set_many', wraps=cache.set_many) as set_many:
+                posts = parser.unpack(content)
+        self.assertEqual(len(posts), 250)
+        self.assertEqual(get_many.call_count, 4)
+        self.assertEqual(set_many.call_count, 4)
+
+        parser = FileParser(cache=ParseCache(alias='default'))
+        with patch.object(parser, 'parse') as parse:
+            self.assertEqual(parser.unpack(content), posts)
+        self.assertFalse(parse.called)
+        self.assertEqual(parser.cache.stats['hits'], 250)
+
+    def test_iter_spans_large_string(self):
+        # About 8MB in one string, as unpack and push_blog_file pass it.
+        # Copying the rest of the string after every segment took seconds.
+        segments = ['title: Post {0}\n\n\n{1}'.format(i, 'x' * 800) for i in range(10000)]
+        content = self.parser.delimiter.join(segments)
+
+        started = time.time()
+        with patch.object(self.parser, 'parse_segments',
+                          side_effect=lambda strings, cached: [None] * len(strings)):
+            spans = list(self.parser.iter_spans(content))
+        self.assertLess(time.time() - started, 2)
+
+        self.assertEqual(len(spans), len(segments))
+        start, end, post = spans[-1]
+        self.assertEqual(content[start:end], segments[-1])
+
+    def test_iter_unpack_is_lazy(self):
+        def chunks():
+            yield 'title: First\n\n\nFirst.\n---\n\n'
+            raise AssertionError('Read past the first post')
+
+        posts = self.parser.iter_unpack(chunks())
+        self.assertEqual(next(posts)['title'], 'First')
+
     @patch('stardate.parsers.logger')
     def test_bad_string(self, mock_logging):
         content = 'bad string\n\r'
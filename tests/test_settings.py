@@ -36,3 +36,10 @@ DROPBOX_ACCESS_TYPE = 'app_folder'
 SOCIAL_AUTH_LOGIN_REDIRECT_URL = '/create/'
 SOCIAL_AUTH_DROPBOX_KEY = DROPBOX_APP_KEY
 SOCIAL_AUTH_DROPBOX_SECRET = DROPBOX_APP_SECRET
+
+TEMPLATES = [
+    {
+        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'APP_DIRS': True,
+    },
+]
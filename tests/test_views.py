@@ -1,10 +1,24 @@
+import datetime
 import hmac
 import json
+import os
+import tempfile
 
 from hashlib import sha256
 
+from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.core.urlresolvers import reverse
+from django.db import connection
 from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from mock import patch
+
+from stardate.models import Blog
+from stardate.utils import get_post_model
+
+Post = get_post_model()
 
 SECRET_KEY = '123456'.encode('utf-8')
 URL = reverse('webhook')
@@ -50,6 +64,318 @@ class TestViews(TestCase):
         )
         self.assertEqual(resp.status_code, 403)
 
+class BlogLookupTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        user = User.objects.create(username='bturner')
+        self.blog = Blog.objects.create(
+            backend_class='stardate.backends.local_file.LocalFileBackend',
+            backend_file=tempfile.mkstemp(suffix='.txt')[1],
+            name='Lookups',
+            user=user,
+        )
+        Post.objects.create(blog=self.blog, title='Hello world', body='Hello.')
+
+    def blog_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return [q['sql'] for q in queries if 'FROM "stardate_blog"' in q['sql']]
+
+    def test_warm_cache_skips_blog_queries(self):
+        for name in ('post-archive-index', 'post-feed'):
+            url = reverse(name, kwargs={'blog_slug': 'Lookups'})
+            self.blog_queries(url)
+            self.assertEqual(self.blog_queries(url), [])
+
+    def test_cache_invalidated_on_save(self):
+        self.assertEqual(Blog.objects.get_by_slug('LOOKUPS').name, 'Lookups')
+
+        blog = Blog.objects.get(pk=self.blog.pk)
+        blog.name = 'Renamed'
+        blog.save()
+        self.assertEqual(Blog.objects.get_by_slug('lookups').name, 'Renamed')
+
+        blog.slug = 'moved'
+        blog.save()
+        with self.assertRaises(Blog.DoesNotExist):
+            Blog.objects.get_by_slug('lookups')
+        self.assertEqual(Blog.objects.get_by_slug('moved').pk, blog.pk)
+
+        blog.delete()
+        with self.assertRaises(Blog.DoesNotExist):
+            Blog.objects.get_by_slug('moved')
+
+
+@patch('stardate.caching.RESPONSE_CACHE_TIMEOUT', 60)
+class ResponseCacheTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        user = User.objects.create(username='bturner')
+        self.blog = Blog.objects.create(
+            backend_class='stardate.backends.local_file.LocalFileBackend',
+            backend_file=tempfile.mkstemp(suffix='.txt')[1],
+            name='Cached',
+            user=user,
+            sync=False,
+        )
+        self.post = Post.objects.create(
+            blog=self.blog, title='Hello world', body='Hello.',
+            publish=datetime.datetime(2016, 1, 1, tzinfo=timezone.utc))
+
+    def test_cached_until_blog_changes(self):
+        urls = [
+            reverse('post-archive-index', kwargs={'blog_slug': 'cached'}),
+            reverse('post-feed', kwargs={'blog_slug': 'cached'}),
+            reverse('post-detail', kwargs={'blog_slug': 'cached', 'post_slug': 'hello-world'}),
+        ]
+        for url in urls:
+            self.client.get(url)
+            with self.assertNumQueries(0):
+                self.assertContains(self.client.get(url), 'Hello world')
+
+        self.post.title = 'Goodbye world'
+        self.post.save()
+
+        for url in urls:
+            self.assertContains(self.client.get(url), 'Goodbye world')
+
+        # Another site's pages are left alone
+        other = Blog.objects.create(name='Other', user=self.blog.user, sync=False)
+        Post.objects.create(blog=other, title='Other post', body='Other.')
+        with self.assertNumQueries(0):
+            self.client.get(urls[0])
+
+    def test_pull_without_changes_keeps_cache(self):
+        temp_dir = tempfile.mkdtemp()
+        path = os.path.join(temp_dir, 'hello-world.md')
+        with open(path, 'w') as f:
+            f.write('stardate: {0}\ntitle: Hello world\n\n\nHello.\n'.format(self.post.stardate))
+
+        self.blog.backend_file = temp_dir
+        self.blog.sync = True
+        self.blog.save()
+
+        url = reverse('post-archive-index', kwargs={'blog_slug': 'cached'})
+        backend = self.blog.backend
+        with patch.object(backend, 'push'):
+            backend.pull()
+            self.client.get(url)
+
+            # A directory blog is pulled every time, but nothing was written
+            self.assertEqual(len(backend.pull(force=True)), 0)
+            with self.assertNumQueries(0):
+                self.assertContains(self.client.get(url), 'Hello world')
+
+            with open(path, 'w') as f:
+                f.write('stardate: {0}\ntitle: Pulled world\n\n\nHello.\n'.format(self.post.stardate))
+            backend.pull(force=True)
+        self.assertContains(self.client.get(url), 'Pulled world')
+
+        os.remove(path)
+        os.removedirs(temp_dir)
+
+    def test_missing_pages_not_cached(self):
+        url = reverse('post-detail', kwargs={'blog_slug': 'cached', 'post_slug': 'missing'})
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+        Post.objects.create(
+            blog=self.blog, title='Missing', body='Found.',
+            publish=datetime.datetime(2016, 1, 2, tzinfo=timezone.utc))
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+
+class ConditionalGetTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        user = User.objects.create(username='bturner')
+        self.blog = Blog.objects.create(
+            backend_class='stardate.backends.local_file.LocalFileBackend',
+            backend_file=tempfile.mkstemp(suffix='.txt')[1],
+            name='Conditional',
+            user=user,
+            sync=False,
+        )
+        self.post = Post.objects.create(
+            blog=self.blog, title='Hello world', body='Hello.',
+            publish=datetime.datetime(2016, 1, 1, tzinfo=timezone.utc))
+        self.urls = [
+            reverse('post-archive-index', kwargs={'blog_slug': 'conditional'}),
+            reverse('post-feed', kwargs={'blog_slug': 'conditional'}),
+            reverse('post-detail', kwargs={'blog_slug': 'conditional', 'post_slug': 'hello-world'}),
+        ]
+
+    def assertNotModified(self, url, response):
+        with self.assertNumQueries(1):
+            not_modified = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+
+        not_modified = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(not_modified.status_code, 304)
+
+    def test_not_modified(self):
+        for url in self.urls:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotModified(url, response)
+
+    def test_modified_by_changes(self):
+        url = self.urls[0]
+        etag = self.client.get(url)['ETag']
+
+        self.post.title = 'Changed'
+        self.post.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotModified(url, response)
+
+        # A new post moves the old one's neighbour link on
+        modified = Post.objects.get(pk=self.post.pk).modified
+        Post.objects.create(
+            blog=self.blog, title='Next', body='Next.',
+            publish=datetime.datetime(2016, 1, 2, tzinfo=timezone.utc))
+        self.assertGreater(Post.objects.get(pk=self.post.pk).modified, modified)
+
+        etag = response['ETag']
+        Post.objects.get(title='Next').delete()
+        self.assertNotEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        # So does a scheduled post going live
+        scheduled = Post.objects.create(
+            blog=self.blog, title='Later', body='Later.',
+            publish=timezone.now() + datetime.timedelta(hours=1))
+        etag = self.client.get(url)['ETag']
+        with patch('stardate.caching.timezone.now',
+                   return_value=scheduled.publish + datetime.timedelta(seconds=1)):
+            self.assertNotEqual(self.client.get(url)['ETag'], etag)
+
+    def test_pull_updates_modified(self):
+        with open(self.blog.backend_file, 'w') as f:
+            f.write('stardate: {0}\ntitle: Pulled\n\n\nPulled.'.format(self.post.stardate))
+
+        modified = Post.objects.get(pk=self.post.pk).modified
+        self.blog.sync = True
+        self.blog.save()
+        with patch.object(self.blog.backend, 'push'):
+            self.blog.backend.pull(force=True)
+
+        self.assertGreater(Post.objects.get(pk=self.post.pk).modified, modified)
+
+
+class KeysetPaginationTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        user = User.objects.create(username='bturner')
+        self.blog = Blog.objects.create(
+            backend_class='stardate.backends.local_file.LocalFileBackend',
+            backend_file=tempfile.mkstemp(suffix='.txt')[1],
+            name='Pages',
+            user=user,
+            sync=False,
+        )
+        # Two posts share a publish date, ids break the tie
+        for i, day in enumerate([1, 2, 3, 3, 4]):
+            Post.objects.create(
+                blog=self.blog, title='Post {0}'.format(i), body='Post.',
+                publish=datetime.datetime(2016, 1, day, tzinfo=timezone.utc))
+
+    def get_page(self, url, **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    @patch('stardate.views.KeysetPaginationMixin.paginate_by', 2)
+    def test_archive_pages(self):
+        for url in [
+            reverse('post-archive-index', kwargs={'blog_slug': 'pages'}),
+            reverse('post-archive-year', kwargs={'blog_slug': 'pages', 'year': '2016'}),
+            reverse('post-archive-month', kwargs={'blog_slug': 'pages', 'year': '2016', 'month': 'jan'}),
+        ]:
+            pages = []
+            response = self.get_page(url)
+            self.assertFalse(response.context['page_obj'].has_previous())
+            while True:
+                page = response.context['page_obj']
+                pages.append([p.title for p in page])
+                if not page.has_next():
+                    break
+                self.assertContains(response, '?after={0}'.format(page.next_cursor))
+                response = self.get_page(url, after=page.next_cursor)
+
+            self.assertEqual(pages, [['Post 4', 'Post 3'], ['Post 2', 'Post 1'], ['Post 0']])
+
+            # And back again
+            response = self.get_page(url, before=page.previous_cursor)
+            page = response.context['page_obj']
+            self.assertEqual([p.title for p in page], ['Post 2', 'Post 1'])
+            self.assertTrue(page.has_next())
+            self.assertTrue(page.has_previous())
+
+        self.assertEqual(self.client.get(url, {'after': 'nonsense'}).status_code, 404)
+        for cursor in ('99999999999999999999.1', '300000000000000000.1',
+                       '0.{0}'.format(2 ** 63), '0.-1'):
+            self.assertEqual(self.client.get(url, {'after': cursor}).status_code, 404)
+            self.assertEqual(self.client.get(url, {'before': cursor}).status_code, 404)
+
+    @patch('stardate.views.KeysetPaginationMixin.paginate_by', 2)
+    def test_deep_pages_seek(self):
+        url = reverse('post-archive-index', kwargs={'blog_slug': 'pages'})
+        cursor = self.get_page(url).context['page_obj'].next_cursor
+
+        with CaptureQueriesContext(connection) as queries:
+            self.get_page(url, after=cursor)
+        self.assertFalse(any('OFFSET' in q['sql'] for q in queries))
+
+
+class ListQueryTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        user = User.objects.create(username='bturner')
+        self.blog = Blog.objects.create(
+            backend_class='stardate.backends.local_file.LocalFileBackend',
+            backend_file=tempfile.mkstemp(suffix='.txt')[1],
+            name='Lists',
+            user=user,
+            sync=False,
+        )
+        self.add_posts(0, 2)
+
+    def add_posts(self, start, stop):
+        for i in range(start, stop):
+            Post.objects.create(
+                blog=self.blog, title='Post {0}'.format(i), body='A long body.',
+                publish=datetime.datetime(2016, 1, i + 1, tzinfo=timezone.utc))
+
+    def get_queries(self, url):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        return [q['sql'] for q in queries]
+
+    def test_constant_queries(self):
+        urls = [
+            reverse('post-archive-index', kwargs={'blog_slug': 'lists'}),
+            reverse('post-archive-year', kwargs={'blog_slug': 'lists', 'year': '2016'}),
+            reverse('post-archive-month', kwargs={'blog_slug': 'lists', 'year': '2016', 'month': 'jan'}),
+            reverse('post-archive-day', kwargs={'blog_slug': 'lists', 'year': '2016', 'month': 'jan', 'day': '1'}),
+            reverse('post-feed', kwargs={'blog_slug': 'lists'}),
+        ]
+        counts = [len(self.get_queries(url)) for url in urls]
+        self.add_posts(2, 8)
+        self.assertEqual([len(self.get_queries(url)) for url in urls], counts)
+
+        # List pages leave bodies out, the feed keeps only the rendered one
+        for url in urls:
+            sql = ' '.join(self.get_queries(url))
+            self.assertNotIn('"stardate_post"."body"', sql)
+            if url == urls[-1]:
+                self.assertIn('"stardate_post"."_body_rendered"', sql)
+            else:
+                self.assertNotIn('"stardate_post"."_body_rendered"', sql)
+
+        self.assertContains(self.client.get(urls[-1]), 'A long body.')
+
+
 def generate_signature(secret, message):
     secret = bytes(secret)
     try: